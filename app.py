@@ -1,78 +1,127 @@
+import os
+import time
+
 import panel as pn
-import pandas as pd
-import matplotlib
-from matplotlib.figure import Figure
-import matplotlib.pyplot as plt
-import numpy as np
 
-matplotlib.use("agg")
+import metrics
+from charts import MAX_BARS, bar_png, bokeh_bar, nothing_png
+from county_data import load_data, load_shared, build_lookups, table_row
+from county_search import CountySearch
+from formatting import RESULTS_PAGE_SIZE, dol, format_results, format_sweep, results_header
+from ranking import CostCube, RankingEngine, budget_ratios, calculate_percentage
+from sweep import Sweep
+from workers import LatestOnly, chart_executor
+
+session_start = time.perf_counter() #app.py runs once per session; the time to build the page is recorded at the end
 
 pn.extension('ipywidgets')
 
 ### Part 0: Getting data
 
-@pn.cache # Add caching to only download data once
+@pn.cache # Add caching to only load data once per process
 def get_data():
-    #df = pd.read_excel('fbc_data_2024.xlsx', sheet_name='County', header=1)
-    df = pd.read_excel('https://files.epi.org/uploads/fbc_data_2024.xlsx', sheet_name='County', header=1)
-    
-    #Drop unneeded columns
-    col_to_drop = list(df.columns[:1]) + list(df.columns[13:21])
-    df = df.drop(columns=col_to_drop)
-
-    #One apparently random county is missing median income data, but is still ranked.
-    #By taking the average of the counties ranked immediately above and below it, a quick estimate of $55,122 can be made.
-    df.fillna(55122.0,inplace=True)
-
-    df['median_family_income'] = df['median_family_income'].astype('int64')
-
-    #Add leading zeroes to FIPS codes makes them readable to Tableau.
-    df['county_fips'] = df['county_fips'].astype(str).str.zfill(5)
-
-    df.columns = ['state_abbr','FIPS','county','family','housing','food','transportation','healthcare',
-                  'other_necessities','childcare','taxes','total','median_family_income',
-                  'num_counties_in_st','st_cost_rank','st_med_aff_rank','st_income_rank']
-    
-    #Some counties share names across states; adding their state code makes them unique.
-    df['county_state'] = df.county + ', ' + df.state_abbr
-    
-    df['median_monthly_family_income'] = df.median_family_income.div(12).round(0).astype('int64')
-    
-    df['remaining_money'] = df.median_monthly_family_income - df.total
-    return df
-
-df = get_data()
+    #Reads the local snapshot made by `python county_data.py`; the workbook is only downloaded if no snapshot exists yet.
+    #With SHARED_DATA_DIR set, every server process maps one shared copy of the table and its cost cube instead of building its own.
+    with metrics.timed('load_data'):
+        if os.environ.get('SHARED_DATA_DIR'):
+            return load_shared(os.environ['SHARED_DATA_DIR'])
+        df, family_rows = build_lookups(load_data())
+        return df, CostCube.from_table(df,family_rows)
+
+df, cube = get_data()
+
+@pn.cache # One engine, and so one results cache, shared by every session in the process
+def get_ranking_engine():
+    with metrics.timed('build_engine'):
+        engine = RankingEngine(cube)
+    metrics.add_collector(lambda: ranking_cache_metrics(engine))
+    return engine
+
+#Function that reports the shared ranking cache's counters on the metrics endpoint
+def ranking_cache_metrics(engine):
+    info = engine.cache_info()
+    return ['# HELP affordable_county_ranking_cache_hits_total Rankings served from the ranking cache.',
+            '# TYPE affordable_county_ranking_cache_hits_total counter', f'affordable_county_ranking_cache_hits_total {info.hits}',
+            '# HELP affordable_county_ranking_cache_misses_total Rankings computed because they were not in the ranking cache.',
+            '# TYPE affordable_county_ranking_cache_misses_total counter', f'affordable_county_ranking_cache_misses_total {info.misses}',
+            '# HELP affordable_county_ranking_cache_entries Rankings held in the ranking cache.',
+            '# TYPE affordable_county_ranking_cache_entries gauge', f'affordable_county_ranking_cache_entries {info.currsize}',
+            '# HELP affordable_county_ranking_cache_bytes Bytes of arrays held in the ranking cache.',
+            '# TYPE affordable_county_ranking_cache_bytes gauge', f'affordable_county_ranking_cache_bytes {info.nbytes}']
+
+ranking_engine = get_ranking_engine()
+
+@pn.cache # The county name index is built once per process, not once per session
+def get_county_search():
+    with metrics.timed('build_county_search'):
+        return CountySearch(ranking_engine.cube.county_state)
+
+county_search = get_county_search()
+
+metrics.serve_metrics() #Only starts if METRICS_PORT is set, and only once per process, each process on its own port
 
 ### Part 1: Find and display model budget
 
-#Function to represent data in US dollars
-def dol(value,df,row=0):
-    return '${:0,}'.format(df[value][row])
+#Function to find the model budget for a county and family size, using the cost cube's county positions instead of scanning the table
+def model_budget(user_county,user_family):
+    return table_row(df,ranking_engine.cube.row(user_county,user_family))
 
 #Function that takes user input and displays the corresponding row from the df
 def calculate_model(user_county,user_parents,user_children):
     user_family = f'{user_parents}p{user_children}c'
-    user_df = df.loc[(df.county_state == user_county) & (df.family == user_family)].reset_index(drop=True)
+    user_row = model_budget(user_county,user_family)
     return (
         f'Moderately frugal families of {user_parents} {"adult" if user_parents == "1" else "adults"} and {user_children} {"child" if user_children == 1 else "children"} living in {user_county} '
         'tend to have a monthly family budget similar to the following:\n'
-        f'\nHousing: {dol("housing",user_df)}'
-        f'\nFood: {dol("food",user_df)}'
-        f'\nTransportation: {dol("transportation",user_df)}'
-        f'\nHealthcare: {dol("healthcare",user_df)}'
-        f'\nChildcare: {dol("childcare",user_df)}'
-        f'\nOther necessities: {dol("other_necessities",user_df)}'
-        f'\nTaxes: {dol("taxes",user_df)}'
-        f'\nTotal: {dol("total",user_df)}'
-        f'\n\nThe median monthly family income for {user_county} is {dol("median_monthly_family_income",user_df)}, which would '
-        f'leave {dol("remaining_money",user_df)} each month for emergencies, saving, and discretionary spending.'
+        f'\nHousing: {dol(user_row.housing)}'
+        f'\nFood: {dol(user_row.food)}'
+        f'\nTransportation: {dol(user_row.transportation)}'
+        f'\nHealthcare: {dol(user_row.healthcare)}'
+        f'\nChildcare: {dol(user_row.childcare)}'
+        f'\nOther necessities: {dol(user_row.other_necessities)}'
+        f'\nTaxes: {dol(user_row.taxes)}'
+        f'\nTotal: {dol(user_row.total)}'
+        f'\n\nThe median monthly family income for {user_county} is {dol(user_row.median_monthly_family_income)}, which would '
+        f'leave {dol(user_row.remaining_money)} each month for emergencies, saving, and discretionary spending.'
     )
 
 #Widgets for receiving user input
-user_county = pn.widgets.AutocompleteInput(
-    name='County of primary residence:', options=df.county_state.unique().tolist(),
-    case_sensitive=False,
-    placeholder='Input county name')
+user_county = pn.widgets.TextInput(name='County of primary residence:', placeholder='Input county name')
+
+#Suggestions come from the server-side index as the user types, instead of sending every county to the browser.
+#They are listed as they are: an autocomplete box would filter them again in the browser against the raw typed text,
+#hiding variants such as "saint lou" for "St. Louis County, MO", and would show the list from the keystroke before.
+county_suggestions = pn.widgets.Select(name='Matching counties:', options=[], size=5, visible=False)
+
+def suggest_counties(event):
+    names = county_search.search(event.new or '')
+    county_suggestions.options = names
+    county_suggestions.visible = bool(names) and names != [user_county.value]
+
+#Picking a suggestion fills in the county
+def pick_county(event):
+    if event.new is not None:
+        user_county.value = event.new
+        county_suggestions.visible = False
+        county_suggestions.value = None #So picking the same county again after more typing still counts
+
+#Typed variants such as "Saint Louis, MO" are swapped for the county name used in the data
+def resolve_county(event):
+    county = county_search.resolve(event.new or '')
+    if county is not None and county != event.new:
+        user_county.value = county
+
+user_county.param.watch(suggest_counties, 'value_input')
+user_county.param.watch(resolve_county, 'value')
+county_suggestions.param.watch(pick_county, 'value')
+
+#Function that checks the county input before any results are calculated
+def county_error():
+    if not user_county.value:
+        return 'County information is required.'
+    if user_county.value not in county_search:
+        return f'No county matches "{user_county.value}". Pick one of the suggestions.'
+    return None
 
 adult_title = pn.pane.Markdown('Number of adults in household:') #Radio buttons don't have their name displayed as a title, so I add it here
 user_parents = pn.widgets.RadioButtonGroup(
@@ -90,9 +139,10 @@ county_submit = pn.widgets.Button(name="Submit Family/Location", button_type="pr
 #Function to make model function respond to submit button
 def county_result(clicked):
     if clicked:
-        if user_county.value == '':
-            return 'County information is required.'
-        return county_model()
+        with metrics.timed('county_result'):
+            if county_error():
+                return county_error()
+            return county_model()
     return "Click Submit Family/Location to see a typical budget."
 
 #Binding button to button function
@@ -101,29 +151,22 @@ county_result = pn.pane.Markdown(pn.bind(county_result,county_submit))
 
 ### Part 2: Calculate and display user budget's comparison to model
 
-#Function to calculate the user budget's comparison to the model. Accounts for dividing by zero.
-def calculate_percentage(user_value,column,df):
-    if df[column][0] == 0:
-        return 1.0
-    else:
-        return 1+round(((user_value-df[column][0])/df[column][0]),3)
-
 #Function that takes user budget input and returns how it compares to model.
 def calculate_budget_percentage(user_county,user_parents,user_children,user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes):
     #Repeated code. Could potentially be avoided with more binding, but that wouldn't change performance
     user_family = f'{user_parents}p{user_children}c'
-    user_df = df.loc[(df.county_state == user_county) & (df.family == user_family)].reset_index(drop=True)
+    user_row = model_budget(user_county,user_family)
     #New code
-    income_p = calculate_percentage(user_income,'median_monthly_family_income',user_df)
-    housing_p = calculate_percentage(user_housing,'housing',user_df)
-    food_p = calculate_percentage(user_food,'food',user_df)
-    transportation_p = calculate_percentage(user_transportation,'transportation',user_df)
-    healthcare_p = calculate_percentage(user_healthcare,'healthcare',user_df)
-    childcare_p = calculate_percentage(user_childcare,'childcare',user_df)
-    other_p = calculate_percentage(user_other,'other_necessities',user_df)
-    taxes_p = calculate_percentage(user_taxes,'taxes',user_df)
+    income_p = calculate_percentage(user_income,user_row.median_monthly_family_income)
+    housing_p = calculate_percentage(user_housing,user_row.housing)
+    food_p = calculate_percentage(user_food,user_row.food)
+    transportation_p = calculate_percentage(user_transportation,user_row.transportation)
+    healthcare_p = calculate_percentage(user_healthcare,user_row.healthcare)
+    childcare_p = calculate_percentage(user_childcare,user_row.childcare)
+    other_p = calculate_percentage(user_other,user_row.other_necessities)
+    taxes_p = calculate_percentage(user_taxes,user_row.taxes)
     total_p = 1+round((((user_housing+user_food+user_transportation+user_healthcare+
-                     user_childcare+user_other+user_taxes)-user_df.total[0])/user_df.total[0]),3)
+                     user_childcare+user_other+user_taxes)-user_row.total)/user_row.total),3)
     return (
         f"Your family's income is {income_p:.1%} that of the median family income in your area. "
         'Your budget compares to the typical model as follows:\n'
@@ -161,9 +204,10 @@ budget_submit = pn.widgets.Button(name="Submit Budget", button_type="primary")
 
 def budget_result(clicked):
     if clicked:
-        if user_county.value == '':
-            return 'County information is required.'
-        return budget_percentage()
+        with metrics.timed('budget_result'):
+            if county_error():
+                return county_error()
+            return budget_percentage()
     return "Click Submit Budget to see how your budget compares."
 
 budget_result = pn.pane.Markdown(pn.bind(budget_result,budget_submit))
@@ -171,70 +215,51 @@ budget_result = pn.pane.Markdown(pn.bind(budget_result,budget_submit))
 
 ### Part 3: Calculate and display most afforable counties and budgets
 
-#Function to take user constraints, find most affordable counties, and calculate budgets
-def calculate_comparison(user_county,user_parents,user_children,user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes,
-                  bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,result_count):
-    #Repeated code:
+#Function to take user constraints, find most affordable counties, and calculate budgets. Shared by the results list and the bar chart.
+def rank_for_user(user_county,user_parents,user_children,user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes,
+                  bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                  min_remaining,max_housing_share,max_total,exclude_home):
     user_family = f'{user_parents}p{user_children}c'
-    user_df = df.loc[(df.county_state == user_county) & (df.family == user_family)].reset_index(drop=True)
-    income_p = calculate_percentage(user_income,'median_monthly_family_income',user_df)
-    housing_p = calculate_percentage(user_housing,'housing',user_df)
-    food_p = calculate_percentage(user_food,'food',user_df)
-    transportation_p = calculate_percentage(user_transportation,'transportation',user_df)
-    healthcare_p = calculate_percentage(user_healthcare,'healthcare',user_df)
-    childcare_p = calculate_percentage(user_childcare,'childcare',user_df)
-    other_p = calculate_percentage(user_other,'other_necessities',user_df)
-    taxes_p = calculate_percentage(user_taxes,'taxes',user_df)
-    #New code:
-    new_df = df.loc[(df.family == user_family)].reset_index(drop=True)
-    if bring_income:
-        new_df.median_monthly_family_income = user_income
-    else:
-        new_df.median_monthly_family_income = new_df.median_monthly_family_income.mul(income_p).round(0).astype('int64')
-    new_df['median_monthly_family_income_uncapped'] = new_df.median_monthly_family_income
-    if income_cap:
-        new_df.median_monthly_family_income.clip(upper=income_cap_amount,inplace=True)
-    if not include_all_states:
-        new_df = new_df.loc[(new_df.state_abbr.isin(states_allowed))].reset_index(drop=True)
-    new_df.housing = new_df.housing.mul(housing_p).round(0).astype('int64')
-    new_df.food = new_df.food.mul(food_p).round(0).astype('int64')
-    new_df.transportation = new_df.transportation.mul(transportation_p).round(0).astype('int64')
-    new_df.healthcare = new_df.healthcare.mul(healthcare_p).round(0).astype('int64')
-    new_df.other_necessities = new_df.other_necessities.mul(other_p).round(0).astype('int64')
-    new_df.childcare = new_df.childcare.mul(childcare_p).round(0).astype('int64')
-    new_df.taxes = new_df.taxes.mul(taxes_p).round(0).astype('int64')
-    new_df.total = new_df.housing + new_df.food + new_df.transportation + new_df.healthcare + new_df.other_necessities + new_df.childcare + new_df.taxes
-    new_df.remaining_money = new_df.median_monthly_family_income - new_df.total
-    new_df = new_df.sort_values('remaining_money',ascending=False).reset_index(drop=True)
-    county_results = []
-    limit = result_count
-    if limit > len(new_df):
-        limit = len(new_df)
-        county_results.append(f'There are only {limit} counties to show!\n\n')
-    if limit == 1:
-        second_line = 'here is the most affordable county for your family, along with what your budget might look living there:\n'
-    else:
-        second_line = f'here are the {limit} most affordable counties for your family, along with what your budget might look living there:\n'
-    if not bring_income and not income_cap:
-        county_results.append("With both your spending and income recalculated based on each county's norm, "
-                             + second_line)
-    elif bring_income:
-        county_results.append("With your exact income maintained but your spending recalculated based on each county's norm, "
-                          + second_line)
-    else:
-        county_results.append(f"With both your spending and income recalculated based on each county's norm (and an income cap of ${income_cap_amount:,.0f}), "
-                          + second_line)
-    for i in range(limit):
-        current_result = [f'\n#{i+1}\n{new_df.county_state[i]}']
-        for [j,k] in [['housing','Housing'],['food','Food'],['transportation','Transportation'],['healthcare','Healthcare'],
-                      ['childcare','Childcare'],['other_necessities','Other necessities'],['taxes','Taxes'],['total','Total'],
-                      ['median_monthly_family_income','Income'],['remaining_money','Remaining money']]:
-            if j == 'median_monthly_family_income' and income_cap == True and new_df.median_monthly_family_income_uncapped[i] > new_df.median_monthly_family_income[i]:
-                current_result.append(f"&nbsp;&nbsp;&nbsp;&nbsp;{k}: {dol(j,new_df,row=i)} (Uncapped: {dol('median_monthly_family_income_uncapped',new_df,row=i)})")
-            else:
-                current_result.append(f"&nbsp;&nbsp;&nbsp;&nbsp;{k}: {dol(j,new_df,row=i)}")
-        county_results.append('\n'.join(current_result))
-    return '\n'.join(county_results)
+    user_row = model_budget(user_county,user_family)
+    income_p, budget_p = budget_ratios(user_row,user_income,[user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes])
+    with metrics.timed('rank','',metrics.states_label(include_all_states,states_allowed)):
+        return ranking_engine.rank(user_family,income_p,budget_p,bring_income,user_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                                   min_remaining=min_remaining,
+                                   max_housing_share=None if max_housing_share is None else max_housing_share/100,
+                                   max_total=max_total,
+                                   exclude_county=user_county if exclude_home else None)
+
+#Function to display the most affordable counties and their budgets, one page at a time
+def calculate_comparison(user_county,user_parents,user_children,user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes,
+                  bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                  min_remaining,max_housing_share,max_total,exclude_home,result_count):
+    ranking = rank_for_user(user_county,user_parents,user_children,user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes,
+                            bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                            min_remaining,max_housing_share,max_total,exclude_home)
+    limit = min(result_count,ranking.count)
+    with metrics.timed('format_results',metrics.result_count_label(result_count)):
+        header = results_header(limit,result_count,bring_income,income_cap,income_cap_amount)
+        first_page = format_results(ranking.page(0,min(limit,RESULTS_PAGE_SIZE)),0,income_cap) if limit else ''
+    results_view = pn.Column(pn.pane.Markdown('\n'.join([header,first_page]) if limit else header))
+    if limit <= RESULTS_PAGE_SIZE:
+        return results_view
+
+    #Later pages are only ranked and formatted when asked for, from the ranking made when Submit was clicked
+    shown = RESULTS_PAGE_SIZE
+    more_button = pn.widgets.Button(name=f'Show more ({limit - shown} left)', button_type='default')
+    def show_more(event):
+        nonlocal shown
+        start, stop = shown, min(shown + RESULTS_PAGE_SIZE,limit)
+        with metrics.timed('show_more',metrics.result_count_label(result_count)):
+            results_view.insert(len(results_view) - 1,pn.pane.Markdown(format_results(ranking.page(start,stop),start,income_cap)))
+        shown = stop
+        if stop >= limit:
+            results_view.remove(more_button)
+        else:
+            more_button.name = f'Show more ({limit - stop} left)'
+    more_button.on_click(show_more)
+    results_view.append(more_button)
+    return results_view
 
 #Constraint widgets
 bring_income_title = pn.pane.Markdown('Maintain income exactly, regardless of county:')
@@ -248,104 +273,178 @@ income_cap_amount = pn.widgets.IntInput(name='Income cap value:', value=0, start
 include_all_states_title = pn.pane.Markdown('Include all states:')
 include_all_states = pn.widgets.Switch(margin=(19,0,0,0),value=True)
 
-states_allowed = pn.widgets.MultiChoice(name='States to include:', options=df.state_abbr.unique().tolist(),disabled= include_all_states) #Would be nice to disable when include_all_states is not active
+states_allowed = pn.widgets.MultiChoice(name='States to include:', options=ranking_engine.cube.states,disabled= include_all_states) #Would be nice to disable when include_all_states is not active
+
+min_remaining = pn.widgets.IntInput(name='Minimum remaining money (blank for none):', value=None)
+
+max_housing_share = pn.widgets.IntInput(name='Maximum housing share of income, % (blank for none):', value=None, start=0, end=100)
+
+max_total = pn.widgets.IntInput(name='Maximum total monthly cost (blank for none):', value=None, start=0)
+
+exclude_home_title = pn.pane.Markdown('Exclude my county:')
+exclude_home = pn.widgets.Switch(margin=(19,0,0,0))
 
 result_count = pn.widgets.IntInput(name='Results to view:', value=5, start=1)
 
 #Bind to widgets
 comparison = pn.bind(calculate_comparison, user_county,user_parents,user_children,
                      user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes,
-                     bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,result_count)
+                     bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                     min_remaining,max_housing_share,max_total,exclude_home,result_count)
 
 #Submit button, bind
 comparison_submit = pn.widgets.Button(name="Submit Constraints", button_type="primary")
 
-def comparison_result(clicked):
-    if clicked:
-        if user_county.value == '':
-            return 'County information is required.'
-        return comparison()
-    return "Click Submit Constraints to see the final results."
+#Function that describes the size of the current request, for the latency metrics
+def request_size():
+    return metrics.result_count_label(result_count.value), metrics.states_label(include_all_states.value,states_allowed.value)
+
+#Function that shows the card is working while a result is computed on the worker pool
+def working(message):
+    return pn.Row(pn.indicators.LoadingSpinner(value=True,size=25),pn.pane.Markdown(message))
+
+#Results are computed on the worker pool, one job at a time per session, so repeated clicks only compute the latest request
+comparison_jobs = LatestOnly()
 
-comparison_result = pn.pane.Markdown(pn.bind(comparison_result,comparison_submit))
+async def comparison_result(clicked):
+    if not clicked:
+        yield "Click Submit Constraints to see the final results."
+        return
+    with metrics.timed('comparison_result',*request_size(),profile=False):
+        if county_error():
+            yield county_error()
+            return
+        yield working('Finding the most affordable counties...')
+        yield await comparison_jobs.run(metrics.timed('comparison_work',*request_size())(comparison))
+
+comparison_result = pn.panel(pn.bind(comparison_result,comparison_submit))
 
 
 ### Part 4: Bar chart of results
+#Function that ranks the counties to chart. Runs on the worker pool; the chart itself is drawn by draw_bar().
 def calculate_bar(user_county,user_parents,user_children,user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes,
-                  bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,result_count,bar_type):
-    #Repeated code:
-    user_family = f'{user_parents}p{user_children}c'
-    user_df = df.loc[(df.county_state == user_county) & (df.family == user_family)].reset_index(drop=True)
-    income_p = calculate_percentage(user_income,'median_monthly_family_income',user_df)
-    housing_p = calculate_percentage(user_housing,'housing',user_df)
-    food_p = calculate_percentage(user_food,'food',user_df)
-    transportation_p = calculate_percentage(user_transportation,'transportation',user_df)
-    healthcare_p = calculate_percentage(user_healthcare,'healthcare',user_df)
-    childcare_p = calculate_percentage(user_childcare,'childcare',user_df)
-    other_p = calculate_percentage(user_other,'other_necessities',user_df)
-    taxes_p = calculate_percentage(user_taxes,'taxes',user_df)
-    new_df = df.loc[(df.family == user_family)].reset_index(drop=True)
-    if bring_income:
-        new_df.median_monthly_family_income = user_income
-    else:
-        new_df.median_monthly_family_income = new_df.median_monthly_family_income.mul(income_p).round(0).astype('int64')
-    new_df['median_monthly_family_income_uncapped'] = new_df.median_monthly_family_income
-    if income_cap:
-        new_df.median_monthly_family_income.clip(upper=income_cap_amount,inplace=True)
-    if not include_all_states:
-        new_df = new_df.loc[(new_df.state_abbr.isin(states_allowed))].reset_index(drop=True)
-    new_df.housing = new_df.housing.mul(housing_p).round(0).astype('int64')
-    new_df.food = new_df.food.mul(food_p).round(0).astype('int64')
-    new_df.transportation = new_df.transportation.mul(transportation_p).round(0).astype('int64')
-    new_df.healthcare = new_df.healthcare.mul(healthcare_p).round(0).astype('int64')
-    new_df.other_necessities = new_df.other_necessities.mul(other_p).round(0).astype('int64')
-    new_df.childcare = new_df.childcare.mul(childcare_p).round(0).astype('int64')
-    new_df.taxes = new_df.taxes.mul(taxes_p).round(0).astype('int64')
-    new_df.total = new_df.housing + new_df.food + new_df.transportation + new_df.healthcare + new_df.other_necessities + new_df.childcare + new_df.taxes
-    new_df.remaining_money = new_df.median_monthly_family_income - new_df.total
-    new_df = new_df.sort_values('remaining_money',ascending=False).reset_index(drop=True)
-    #New code:
-    new_df = new_df[:result_count]
-    fig = Figure(figsize=(result_count,3))
-    ax = fig.add_subplot(111)
-    if bar_type == 'Stacked':
-        stacked_value=True
-    else:
-        stacked_value=False
-    ax = new_df[['remaining_money','housing','food','transportation','healthcare','childcare','other_necessities','taxes']].plot.bar(
-        stacked=stacked_value, width=0.8, ax=ax, color=['limegreen','wheat','gold','paleturquoise','salmon','violet','silver','dimgrey'])
-    ax.legend(labels=['Remaining Money','Housing','Food','Transportation','Healthcare','Childcare','Other','Taxes'],reverse=True,loc="upper right",bbox_to_anchor=(1 + 2.41/result_count, 1))
-    ax.set_xticks(ticks=np.arange(len(new_df)),labels=new_df.county_state.values)
-    ax.yaxis.set_major_formatter('${x:,.0f}')
-    ax.yaxis.grid(linestyle='--',alpha=.4)
-    ax.set_xlim([-.5, len(new_df)-.5])
-    plt.close(fig)
-    return fig
-
-def nothing_fig():
-    fig = Figure(figsize=(5,4))
-    ax = fig.add_subplot(111)
-    return fig
+                  bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                  min_remaining,max_housing_share,max_total,exclude_home,result_count,bar_type,bar_renderer):
+    ranking = rank_for_user(user_county,user_parents,user_children,user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes,
+                            bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                            min_remaining,max_housing_share,max_total,exclude_home)
+    bar_count = min(result_count,MAX_BARS) #Very wide charts are slow to draw and unreadable, so only the top MAX_BARS are charted
+    note = None
+    if result_count > MAX_BARS and ranking.count > MAX_BARS:
+        note = f'The chart shows the top {MAX_BARS} counties. All {min(result_count,ranking.count)} are listed above.'
+    return ranking.top(bar_count),bar_type,bar_count,bar_renderer,note
+
+#Function that draws the chart of the counties calculate_bar() found
+def draw_bar(new_df,bar_type,bar_count,bar_renderer,note):
+    if new_df.empty:
+        return nothing_chart()
+    with metrics.timed('chart_bokeh' if bar_renderer == 'Interactive' else 'chart_png',metrics.result_count_label(bar_count)):
+        if bar_renderer == 'Interactive':
+            chart = pn.pane.Bokeh(bokeh_bar(new_df,bar_type,bar_count))
+        else:
+            chart = pn.pane.PNG(bar_png(new_df,bar_type,bar_count))
+    if note:
+        return pn.Column(pn.pane.Markdown(note),chart)
+    return chart
+
+def nothing_chart():
+    return pn.pane.PNG(nothing_png())
 
 bar_type_title = pn.pane.Markdown('Type of bar chart:')
 bar_type = pn.widgets.RadioButtonGroup(
     options=['Stacked', 'Clustered'], button_type='default', margin=(12,0,0,0))
 
+bar_renderer_title = pn.pane.Markdown('Bar chart rendering:') #Interactive charts are drawn by the browser instead of the server
+bar_renderer = pn.widgets.RadioButtonGroup(
+    options=['Image', 'Interactive'], button_type='default', margin=(12,0,0,0))
+
 bar = pn.bind(calculate_bar, user_county,user_parents,user_children,
                      user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes,
-                     bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,result_count,bar_type)
+                     bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                     min_remaining,max_housing_share,max_total,exclude_home,result_count,bar_type,bar_renderer)
+
+bar_jobs = LatestOnly()
+
+async def bar_result(clicked):
+    if not clicked:
+        yield nothing_chart()
+        return
+    with metrics.timed('bar_result',*request_size(),profile=False):
+        if county_error():
+            yield nothing_chart()
+            return
+        yield working('Drawing the chart...')
+        chart = await bar_jobs.run(metrics.timed('bar_work',*request_size())(bar))
+        #Image charts go to the chart thread, which draws them one at a time, instead of waiting for their turn on a pool thread
+        yield await bar_jobs.run(draw_bar,*chart,pool=chart_executor() if chart[3] == 'Image' else None)
+
+bar_result = pn.panel(pn.bind(bar_result,comparison_submit))
+
+
+### Part 5: Sweep of income or income cap
+#Instead of resubmitting with one income or cap after another, a sweep ranks the counties across a whole range of values at once
+#and shows exactly where the most affordable counties change.
+
+SWEEP_MAX_TOP = 10 #Each range lists at most this many counties, however many results were asked for
+
+def calculate_sweep(user_county,user_parents,user_children,user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes,
+                    bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                    min_remaining,max_housing_share,max_total,exclude_home,result_count,sweep_variable,sweep_start,sweep_stop):
+    if sweep_start is None or sweep_stop is None or sweep_stop < sweep_start:
+        return 'Enter a sweep range with "from" no larger than "to".'
+    user_family = f'{user_parents}p{user_children}c'
+    user_row = model_budget(user_county,user_family)
+    income_p, budget_p = budget_ratios(user_row,user_income,[user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes])
+    top_n = min(result_count,SWEEP_MAX_TOP)
+    with metrics.timed('sweep',metrics.result_count_label(top_n),metrics.states_label(include_all_states,states_allowed)):
+        sweep = Sweep(ranking_engine.cube,user_family,income_p,budget_p,bring_income,user_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                      min_remaining=min_remaining,
+                      max_housing_share=None if max_housing_share is None else max_housing_share/100,
+                      max_total=max_total,
+                      exclude_county=user_county if exclude_home else None,
+                      model_income=user_row.median_monthly_family_income,
+                      variable='income_cap' if sweep_variable == 'Income cap' else 'income',
+                      top_n=top_n)
+        try:
+            changes = sweep.frame(*sweep.breakpoints(sweep_start,sweep_stop))
+        except ValueError as error: #Such as an income range with too many ratios to rank
+            return str(error)
+        return format_sweep(changes,sweep_start,sweep_stop,sweep_variable)
+
+sweep_title = pn.pane.Markdown('## Part 4: Sweep')
+sweep_variable_title = pn.pane.Markdown('Value to sweep:')
+sweep_variable = pn.widgets.RadioButtonGroup(
+    options=['Income cap', 'Income'], button_type='default', margin=(12,0,0,0))
+
+SWEEP_MAX_VALUE = 100_000 #Monthly dollars; well above any county's median income, and keeps sweeps quick
+
+sweep_start = pn.widgets.IntInput(name='Sweep from:', value=3000, start=0, end=SWEEP_MAX_VALUE)
+sweep_stop = pn.widgets.IntInput(name='Sweep to:', value=12000, start=0, end=SWEEP_MAX_VALUE)
+
+sweep = pn.bind(calculate_sweep, user_county,user_parents,user_children,
+                     user_income,user_housing,user_food,user_transportation,user_healthcare,user_childcare,user_other,user_taxes,
+                     bring_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                     min_remaining,max_housing_share,max_total,exclude_home,result_count,sweep_variable,sweep_start,sweep_stop)
 
-def bar_result(clicked):
-    if clicked:
-        if user_county.value == '':
-            return nothing_fig()
-        return bar()
-    return nothing_fig()
+sweep_submit = pn.widgets.Button(name="Run Sweep", button_type="primary")
 
-bar_result = pn.pane.Matplotlib(pn.bind(bar_result,comparison_submit), dpi=144, tight=True)
+sweep_jobs = LatestOnly()
 
+async def sweep_result(clicked):
+    if not clicked:
+        yield "Click Run Sweep to see where the most affordable counties change as your income or income cap varies."
+        return
+    with metrics.timed('sweep_result',*request_size(),profile=False):
+        if county_error():
+            yield county_error()
+            return
+        yield working('Sweeping...')
+        yield await sweep_jobs.run(metrics.timed('sweep_work',*request_size())(sweep))
 
-### Part 5: Templating
+sweep_result = pn.panel(pn.bind(sweep_result,sweep_submit))
+
+
+### Part 6: Templating
 
 template = pn.template.BootstrapTemplate(title='Affordable County Locator')
 
@@ -357,9 +456,10 @@ part1_title = pn.pane.Markdown('## Part 1: County and family size')
 part2_title = pn.pane.Markdown('## Part 2: Budget')
 part3_title = pn.pane.Markdown('## Part 3: Calculation constraints')
 
-template.sidebar.extend([intro, part1_title, user_county, pn.Row(adult_title, user_parents), user_children, county_submit,
+template.sidebar.extend([intro, part1_title, user_county, county_suggestions, pn.Row(adult_title, user_parents), user_children, county_submit,
                          part2_title, user_income, budget_title, user_housing, user_food, user_transportation, user_healthcare, user_childcare, user_other, user_taxes, budget_submit,
-                         part3_title, pn.Row(bring_income_title, bring_income),pn.Row(income_cap_title, income_cap),income_cap_amount,pn.Row(include_all_states_title, include_all_states),states_allowed,result_count,pn.Row(bar_type_title,bar_type),comparison_submit])
+                         part3_title, pn.Row(bring_income_title, bring_income),pn.Row(income_cap_title, income_cap),income_cap_amount,pn.Row(include_all_states_title, include_all_states),states_allowed,min_remaining,max_housing_share,max_total,pn.Row(exclude_home_title, exclude_home),result_count,pn.Row(bar_type_title,bar_type),pn.Row(bar_renderer_title,bar_renderer),comparison_submit,
+                         sweep_title, pn.Row(sweep_variable_title,sweep_variable),sweep_start,sweep_stop,sweep_submit])
 
 #Main formatting
 main1 = pn.Card(
@@ -383,8 +483,16 @@ main4 = pn.Card(
     title='Most Affordable Counties, bar chart',
     styles={'background':'WhiteSmoke'}
 )
+main5 = pn.Card(
+    sweep_result,
+    title='Most Affordable Counties, across incomes or income caps',
+    styles={'background':'WhiteSmoke'},
+    max_height = 300
+)
 template.main.append(
-    pn.Column(main1,main2,main3,main4)
+    pn.Column(main1,main2,main3,main4,main5)
 )
 
 template.servable();
+
+metrics.record('session_setup',time.perf_counter() - session_start)
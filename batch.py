@@ -0,0 +1,166 @@
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from county_data import load_data, build_lookups
+from ranking import BUDGET_COLUMNS, CostCube, constraint_mask, top_in_rows
+
+#Columns of a household profile file. Those after the budget are optional; blank values mean "off" / "all states".
+#max_housing_share is a fraction of income (0.3 for 30%).
+PROFILE_COLUMNS = (['county','adults','children','income'] + BUDGET_COLUMNS +
+                   ['bring_income','income_cap','states','min_remaining','max_housing_share','max_total','exclude_home'])
+OPTIONAL_COLUMNS = {'bring_income': False, 'income_cap': np.nan, 'states': '',
+                    'min_remaining': np.nan, 'max_housing_share': np.nan, 'max_total': np.nan, 'exclude_home': False}
+
+RESULT_COLUMNS = (['profile','rank','county_state','state_abbr','FIPS','county'] + BUDGET_COLUMNS +
+                  ['total','median_monthly_family_income','median_monthly_family_income_uncapped','remaining_money'])
+
+### Reading and writing files
+
+def read_table(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+def write_table(df,path):
+    if path.endswith('.parquet'):
+        df.to_parquet(path,index=False)
+    else:
+        df.to_csv(path,index=False)
+
+#Function that fills in optional columns and checks every profile matches a county and family in the data
+def prepare_profiles(profiles,cube):
+    missing = [column for column in PROFILE_COLUMNS if column not in profiles.columns and column not in OPTIONAL_COLUMNS]
+    if missing:
+        raise ValueError(f'Profiles are missing required columns: {", ".join(missing)}')
+    profiles = profiles.reset_index(drop=True).copy()
+    for column, default in OPTIONAL_COLUMNS.items():
+        if column not in profiles.columns:
+            profiles[column] = default
+    profiles['family'] = profiles.adults.astype(int).astype(str) + 'p' + profiles.children.astype(int).astype(str) + 'c'
+    rows = [cube.row(county,family) for county, family in zip(profiles.county,profiles.family)]
+    unknown = [i for i, row in enumerate(rows) if row is None]
+    if unknown:
+        raise ValueError(f'{len(unknown)} profiles do not match a county and family in the data, starting with row {unknown[0]}: '
+                         f'{profiles.county[unknown[0]]!r}, {profiles.family[unknown[0]]}')
+    profiles['row'] = rows
+    return profiles
+
+#Function that reads a true/false column of profiles; blank cells are false
+def parse_flags(profiles,column):
+    try:
+        return profiles[column].astype('boolean').fillna(False).to_numpy(dtype=bool)
+    except (TypeError, ValueError):
+        raise ValueError(f'Column {column} must hold true/false values (or be blank for false).') from None
+
+#Function that splits a states cell such as "NY TX", "NY;TX" or "NY,TX" into a tuple; blank means every state
+def parse_states(value):
+    if not isinstance(value,str) or not value.strip():
+        return None
+    return tuple(sorted(set(re.split(r'[\s,;]+',value.strip().upper()))))
+
+
+### Vectorized ranking
+
+#Vectorized calculate_percentage. The app's model values are NumPy integers, so its round() is NumPy's, the same as np.round here.
+def calculate_percentages(user_values,model_values):
+    model_values = model_values.astype(float)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        ratios = 1 + np.round((user_values - model_values) / model_values,3)
+    return np.where(model_values == 0,1.0,ratios)
+
+#Function that ranks counties for a chunk of profiles that share a family, as one (profiles x counties x categories) computation.
+#Ties are broken by county position, the same as RankingEngine, so results match the app.
+def rank_chunk(cube,family,profile_ids,income_p,fixed_income,budget_p,income_cap,allowed,limits,top_n):
+    n_counties = len(cube.county_state)
+    costs = np.rint(cube.costs[family][None,:,:] * budget_p[:,None,:]).astype(np.int64)
+    total = costs.sum(axis=2)
+    scaled_income = np.rint(cube.income[family][None,:] * income_p[:,None]).astype(np.int64)
+    uncapped_income = np.where(np.isnan(fixed_income)[:,None],scaled_income,np.nan_to_num(fixed_income).astype(np.int64)[:,None])
+    income = np.minimum(uncapped_income,income_cap[:,None])
+    remaining = income - total
+    #Unset limits are NaN, which constraint_mask treats as off
+    min_remaining, max_housing_share, max_total = (limit[:,None] for limit in limits)
+    allowed = allowed & constraint_mask(costs[:,:,BUDGET_COLUMNS.index('housing')],total,income,remaining,min_remaining,max_housing_share,max_total)
+
+    positions, valid = top_in_rows(remaining,allowed,np.arange(n_counties),n_counties,top_n)
+    n = positions.shape[1]
+
+    rows = np.repeat(np.arange(len(profile_ids)),n).reshape(-1,n)
+    rows, positions = rows[valid], positions[valid]
+    ranks = np.broadcast_to(np.arange(1,n + 1),valid.shape)[valid]
+    columns = {
+        'profile': profile_ids[rows],
+        'rank': ranks,
+        'county_state': cube.county_state[positions],
+        'state_abbr': cube.state_abbr[positions],
+        'FIPS': cube.fips[positions],
+        'county': cube.county[positions],
+    }
+    for i, column in enumerate(BUDGET_COLUMNS):
+        columns[column] = costs[rows,positions,i]
+    columns['total'] = total[rows,positions]
+    columns['median_monthly_family_income'] = income[rows,positions]
+    columns['median_monthly_family_income_uncapped'] = uncapped_income[rows,positions]
+    columns['remaining_money'] = remaining[rows,positions]
+    return pd.DataFrame(columns)
+
+#Function that returns a (profiles x counties) mask of the counties each profile may be shown: those in its states,
+#less its home county where home is not -1
+def allowed_counties(state_masks,states,home):
+    allowed = np.stack([state_masks[key] for key in states])
+    excluded = np.flatnonzero(home >= 0)
+    allowed[excluded,home[excluded]] = False
+    return allowed
+
+#Function that returns the top_n counties for every profile, with the full recomputed budget.
+#Profiles are processed per family in chunks of chunk_size, so memory stays bounded at roughly chunk_size x counties x 7 values.
+def rank_profiles(profiles,df,cube,top_n=5,chunk_size=128):
+    profiles = prepare_profiles(profiles,cube)
+    rows = profiles.row.to_numpy()
+
+    #Only the model columns the ratios need are gathered, rather than copying each profile's whole row of the table
+    income_p = calculate_percentages(profiles.income.to_numpy(),df.median_monthly_family_income.to_numpy()[rows])
+    budget_p = calculate_percentages(profiles[BUDGET_COLUMNS].to_numpy(),df[BUDGET_COLUMNS].to_numpy()[rows])
+    bring_income = parse_flags(profiles,'bring_income')
+    fixed_income = np.where(bring_income,profiles.income.to_numpy(dtype=float),np.nan)
+    cap_amount = pd.to_numeric(profiles.income_cap,errors='coerce').to_numpy(dtype=float)
+    has_cap = ~np.isnan(cap_amount)
+    income_cap = np.full(len(profiles),np.iinfo(np.int64).max,dtype=np.int64)
+    income_cap[has_cap] = cap_amount[has_cap].astype(np.int64)
+
+    limits = [pd.to_numeric(profiles[column],errors='coerce').to_numpy(dtype=float) for column in ['min_remaining','max_housing_share','max_total']]
+
+    #One mask per distinct set of states; each chunk's rows are copied from these as it is ranked
+    states = [parse_states(value) for value in profiles.states]
+    state_masks = {key: cube.state_mask(key) for key in set(states)}
+    exclude_home = parse_flags(profiles,'exclude_home')
+    home = np.array([cube.county_index[county] if exclude else -1 for county, exclude in zip(profiles.county,exclude_home)],dtype=np.int64)
+
+    results = []
+    for user_family, group in profiles.groupby('family',sort=False).indices.items():
+        family = cube.family_index[user_family]
+        for start in range(0,len(group),chunk_size):
+            ids = group[start:start + chunk_size]
+            allowed = allowed_counties(state_masks,[states[i] for i in ids],home[ids])
+            results.append(rank_chunk(cube,family,ids,income_p[ids],fixed_income[ids],budget_p[ids],income_cap[ids],allowed,[limit[ids] for limit in limits],top_n))
+    if not results:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(results,ignore_index=True).sort_values(['profile','rank'],kind='stable').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rank the most affordable counties for every household profile in a CSV or Parquet file.')
+    parser.add_argument('profiles', help=f'CSV or Parquet file with columns: {", ".join(PROFILE_COLUMNS)}')
+    parser.add_argument('output', help='CSV or Parquet file to write the results to')
+    parser.add_argument('--top', type=int, default=5, help='Counties to keep per profile (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=128, help='Profiles ranked at once; lower it to use less memory (default: %(default)s)')
+    args = parser.parse_args()
+
+    df, family_rows = build_lookups(load_data())
+    results = rank_profiles(read_table(args.profiles),df,CostCube.from_table(df,family_rows),args.top,args.chunk_size)
+    write_table(results,args.output)
+    print(f'Wrote {len(results)} rows for {results.profile.nunique()} profiles to {os.path.abspath(args.output)}')
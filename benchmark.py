@@ -0,0 +1,253 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from batch import rank_profiles
+from charts import MAX_BARS, bar_figure, bar_png, bokeh_bar, figure_png
+from county_data import build_lookups, compact_table, prepare_data, read_snapshot, read_workbook, table_row, write_snapshot
+from county_search import CountySearch
+from formatting import RESULTS_PAGE_SIZE, format_results, results_header
+from ranking import CostCube, RankingEngine, budget_ratios
+from sweep import Sweep
+from synthetic_data import make_county_sheet, make_profiles, write_workbook
+
+#Benchmarks every step a request goes through, on synthetic data so it runs offline and gives the same data every time.
+#Results are saved as JSON; pass an earlier file to --compare to flag regressions.
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results')
+
+#A typical household: the model budget for its county, somewhat above median income
+BUDGET = [1400, 700, 900, 800, 600, 400, 1000]
+INCOME = 7500
+
+### Measuring
+
+#Function that times repeat calls (after one warm-up call), then measures peak Python memory over one more call
+def measure(function, repeat):
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times = np.array(times)
+    return {
+        'repeat': repeat,
+        'mean_ms': float(times.mean()),
+        'p50_ms': float(np.percentile(times, 50)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'p99_ms': float(np.percentile(times, 99)),
+        'max_ms': float(times.max()),
+        'peak_kib': peak / 1024,
+    }
+
+def benchmark_key(result):
+    return result['name'] + ' ' + json.dumps(result['params'], sort_keys=True)
+
+
+### Benchmarks
+#Each function yields (name, params, function, repeat) for everything it wants timed.
+
+def ingest_benchmarks(sheet, snapshot_dir, repeat, include_excel):
+    df = prepare_data(sheet)
+    yield 'prepare_data', {}, lambda: prepare_data(sheet), repeat
+    yield 'write_snapshot', {}, lambda: write_snapshot(df, 'synthetic', '2024-01-01', '', snapshot_dir), repeat
+    yield 'read_snapshot', {}, lambda: read_snapshot(snapshot_dir), repeat
+    yield 'read_snapshot', {'compact': True}, lambda: read_snapshot(snapshot_dir, compact=True), repeat
+    yield 'compact_table', {}, lambda: compact_table(df), repeat
+    df = compact_table(df)
+    yield 'build_lookups', {}, lambda: build_lookups(df), repeat
+    sorted_df, family_rows = build_lookups(df)
+    yield 'build_engine', {}, lambda: RankingEngine(CostCube.from_table(sorted_df, family_rows)), repeat
+    yield 'build_county_search', {}, lambda: CountySearch(sorted_df.county_state), repeat
+    if include_excel:
+        buffer = io.BytesIO()
+        write_workbook(sheet, buffer)
+        content = buffer.getvalue()
+        yield 'read_workbook', {}, lambda: read_workbook(content), max(1, repeat // 20)
+
+def lookup_benchmarks(df, cube, search, county, repeat):
+    def model_lookup():
+        user_row = table_row(df, cube.row(county, '2p2c'))
+        return budget_ratios(user_row, INCOME, BUDGET)
+    yield 'model_lookup', {}, model_lookup, repeat
+    yield 'county_search', {'query': 'sa'}, lambda: search.search('sa'), repeat
+    yield 'county_resolve', {}, lambda: search.resolve(county.lower()), repeat
+
+def ranking_benchmarks(df, cube, county, repeat):
+    cold = RankingEngine(cube, maxbytes=0)
+    warm = RankingEngine(cube)
+    income_p, budget_p = budget_ratios(table_row(df, cube.row(county, '2p2c')), INCOME, BUDGET)
+    n_counties = len(cold.cube.county_state)
+    states = cold.cube.states
+    income_modes = {'scaled': (False, False, 0), 'fixed': (True, False, 0), 'capped': (False, True, INCOME)}
+    state_sets = {'all': None, '1 state': states[:1], '10 states': states[:10]}
+    #Sizes are capped at the number of counties, so with a small --counties each label matches the rows actually ranked
+    for result_count in sorted({min(count, n_counties) for count in [5, 50, 500, n_counties]}):
+        for state_name, allowed in state_sets.items():
+            for mode, (bring_income, income_cap, cap_amount) in income_modes.items():
+                params = {'result_count': result_count, 'states': state_name, 'income': mode}
+                def rank():
+                    ranking = cold.rank('2p2c', income_p, budget_p, bring_income, INCOME, income_cap, cap_amount, allowed is None, allowed or [])
+                    return ranking.top(result_count)
+                yield 'rank', params, rank, repeat
+        yield 'rank_cached', {'result_count': result_count}, lambda: warm.rank('2p2c', income_p, budget_p, False, INCOME, False, 0, True, []).top(result_count), repeat
+    yield 'rank_constrained', {}, lambda: cold.rank('2p2c', income_p, budget_p, False, INCOME, False, 0, True, [],
+                                                    min_remaining=0, max_housing_share=0.3, max_total=9000, exclude_county=county).top(5), repeat
+
+def sweep_benchmarks(df, cube, county, repeat):
+    user_row = table_row(df, cube.row(county, '2p2c'))
+    income_p, budget_p = budget_ratios(user_row, INCOME, BUDGET)
+    for variable, bring_income in [('income_cap', False), ('income', False), ('income', True)]:
+        def run_sweep():
+            sweep = Sweep(cube, '2p2c', income_p, budget_p, bring_income, INCOME, variable == 'income_cap', INCOME, True, [],
+                          model_income=user_row.median_monthly_family_income, variable=variable, top_n=10)
+            return sweep.run(2000, 15000, 500)
+        yield 'sweep', {'variable': variable, 'income': 'fixed' if bring_income else 'scaled'}, run_sweep, max(3, repeat // 10)
+
+def formatting_benchmarks(df, cube, county, repeat):
+    engine = RankingEngine(cube)
+    income_p, budget_p = budget_ratios(table_row(df, cube.row(county, '2p2c')), INCOME, BUDGET)
+    ranking = engine.rank('2p2c', income_p, budget_p, False, INCOME, True, INCOME, True, [])
+    for result_count in sorted({min(count, ranking.count) for count in [RESULTS_PAGE_SIZE, 500, ranking.count]}):
+        new_df = ranking.top(result_count)
+        def format_page():
+            return results_header(result_count, result_count, False, True, INCOME) + format_results(new_df, 0, True)
+        yield 'format_results', {'rows': result_count}, format_page, repeat
+
+def chart_benchmarks(df, cube, county, repeat):
+    engine = RankingEngine(cube)
+    income_p, budget_p = budget_ratios(table_row(df, cube.row(county, '2p2c')), INCOME, BUDGET)
+    ranking = engine.rank('2p2c', income_p, budget_p, False, INCOME, False, 0, True, [])
+    chart_repeat = max(3, repeat // 10)
+    for result_count in [5, MAX_BARS]:
+        new_df = ranking.top(result_count)
+        for bar_type in ['Stacked', 'Clustered']:
+            params = {'result_count': result_count, 'bar_type': bar_type}
+            yield 'chart_png', params, lambda: figure_png(bar_figure(new_df, bar_type, result_count)), chart_repeat
+            yield 'chart_png_cached', params, lambda: bar_png(new_df, bar_type, result_count), repeat
+            yield 'chart_bokeh', params, lambda: bokeh_bar(new_df, bar_type, result_count), chart_repeat
+
+def batch_benchmarks(df, cube, repeat):
+    for n_profiles in [100, 1000]:
+        profiles = make_profiles(df, n_profiles)
+        yield 'batch', {'profiles': n_profiles}, lambda: rank_profiles(profiles, df, cube), max(3, repeat // 10)
+
+
+### Reporting
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+KEY_WIDTH = 80 #Wide enough for the longest benchmark name and params, so no two rows print alike
+
+def print_header():
+    print(f'{"benchmark":<{KEY_WIDTH}} {"p50 ms":>9} {"p95 ms":>9} {"max ms":>9} {"peak KiB":>10}')
+
+def print_result(result):
+    print(f'{benchmark_key(result):<{KEY_WIDTH}} {result["p50_ms"]:>9.3f} {result["p95_ms"]:>9.3f} {result["max_ms"]:>9.3f} {result["peak_kib"]:>10.1f}')
+
+#Function that compares median times with an earlier run and returns the benchmarks that got slower than threshold allows.
+#Differences under NOISE_MS are ignored, since sub-millisecond timings jitter by more than any threshold.
+NOISE_MS = 0.5
+
+def compare_results(results, previous, threshold):
+    before = {benchmark_key(result): result for result in previous['results']}
+    regressions = []
+    for result in results:
+        key = benchmark_key(result)
+        if key in before:
+            ratio = result['p50_ms'] / max(before[key]['p50_ms'], 1e-6)
+            flag = ' REGRESSION' if ratio > threshold and result['p50_ms'] - before[key]['p50_ms'] > NOISE_MS else ''
+            print(f'{key:<{KEY_WIDTH}} {before[key]["p50_ms"]:>9.3f} -> {result["p50_ms"]:>9.3f} ms ({ratio:.2f}x){flag}')
+            if flag:
+                regressions.append(key)
+    return regressions
+
+
+if __name__ == '__main__':
+    groups = ['ingest', 'lookup', 'ranking', 'sweep', 'formatting', 'charts', 'batch']
+    parser = argparse.ArgumentParser(description='Benchmark data loading, ranking, formatting and charts on synthetic data.')
+    parser.add_argument('--counties', type=int, default=3143, help='Number of synthetic counties (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=50, help='Timed calls per benchmark; slow ones use fewer (default: %(default)s)')
+    parser.add_argument('--only', nargs='+', choices=groups, default=groups, help='Benchmark groups to run (default: all)')
+    parser.add_argument('--excel', action='store_true', help='Also time reading the workbook with pd.read_excel (slow)')
+    parser.add_argument('--output', help=f'JSON file for the results (default: a new file in {RESULTS_DIR})')
+    parser.add_argument('--compare', help='Earlier results file to compare median times against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Slowdown ratio counted as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    sheet = make_county_sheet(args.counties, args.seed)
+    full_df = prepare_data(sheet)
+    df, family_rows = build_lookups(compact_table(full_df))
+    cube = CostCube.from_table(df, family_rows)
+    search = CountySearch(df.county_state)
+    county = df.county_state.iloc[len(df) // 20]
+
+    #The app holds the compact table; the prepared one is what it would hold otherwise
+    table_bytes = {'prepared': int(full_df.memory_usage(deep=True).sum()), 'compact': int(df.memory_usage(deep=True).sum())}
+    print(f'Table in memory: {table_bytes["prepared"] / 2**20:.1f} MiB prepared, {table_bytes["compact"] / 2**20:.1f} MiB compact\n')
+
+    results = []
+    print_header()
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        suites = {
+            'ingest': lambda: ingest_benchmarks(sheet, snapshot_dir, args.repeat, args.excel),
+            'lookup': lambda: lookup_benchmarks(df, cube, search, county, args.repeat),
+            'ranking': lambda: ranking_benchmarks(df, cube, county, args.repeat),
+            'sweep': lambda: sweep_benchmarks(df, cube, county, args.repeat),
+            'formatting': lambda: formatting_benchmarks(df, cube, county, args.repeat),
+            'charts': lambda: chart_benchmarks(df, cube, county, args.repeat),
+            'batch': lambda: batch_benchmarks(df, cube, args.repeat),
+        }
+        for group in args.only:
+            for name, params, function, repeat in suites[group]():
+                results.append({'group': group, 'name': name, 'params': params, **measure(function, repeat)})
+                print_result(results[-1])
+
+    report = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'counties': args.counties,
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'table_bytes': table_bytes,
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'benchmark-{datetime.datetime.now():%Y%m%d-%H%M%S}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nSaved {len(results)} results to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f'\nCompared with {args.compare} (commit {previous.get("commit")}):')
+        regressions = compare_results(results, previous, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} benchmarks are more than {args.threshold}x slower.')
+            sys.exit(1)
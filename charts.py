@@ -0,0 +1,125 @@
+import functools
+import io
+import threading
+
+import matplotlib
+from matplotlib.figure import Figure
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from bokeh.models import ColumnDataSource, HoverTool, NumeralTickFormatter
+from bokeh.plotting import figure
+
+matplotlib.use("agg")
+
+CHART_COLUMNS = ['remaining_money','housing','food','transportation','healthcare','childcare','other_necessities','taxes']
+CHART_LABELS = ['Remaining Money','Housing','Food','Transportation','Healthcare','Childcare','Other','Taxes']
+CHART_COLORS = ['limegreen','wheat','gold','paleturquoise','salmon','violet','silver','dimgrey']
+
+MAX_BARS = 50 #Larger result counts only chart the top MAX_BARS counties; the full list is still in the results card
+DPI = 144
+
+### Matplotlib image
+
+#Function that draws the bar chart for the ranked counties in new_df. result_count sets the width, as in the original chart.
+def bar_figure(new_df,bar_type,result_count):
+    fig = Figure(figsize=(result_count,3))
+    ax = fig.add_subplot(111)
+    if bar_type == 'Stacked':
+        stacked_value=True
+    else:
+        stacked_value=False
+    ax = new_df[CHART_COLUMNS].plot.bar(
+        stacked=stacked_value, width=0.8, ax=ax, color=CHART_COLORS)
+    ax.legend(labels=CHART_LABELS,reverse=True,loc="upper right",bbox_to_anchor=(1 + 2.41/result_count, 1))
+    ax.set_xticks(ticks=np.arange(len(new_df)),labels=new_df.county_state.values)
+    ax.yaxis.set_major_formatter('${x:,.0f}')
+    ax.yaxis.grid(linestyle='--',alpha=.4)
+    ax.set_xlim([-.5, len(new_df)-.5])
+    plt.close(fig)
+    return fig
+
+def nothing_fig():
+    fig = Figure(figsize=(5,4))
+    ax = fig.add_subplot(111)
+    return fig
+
+#Function that rasterizes a figure the same way pn.pane.Matplotlib(dpi=144, tight=True) does
+def figure_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer,format='png',dpi=DPI,bbox_inches='tight',facecolor=fig.get_facecolor(),edgecolor=fig.get_edgecolor())
+    return buffer.getvalue()
+
+#Function that returns the chart as PNG bytes. Rendered images are kept in a bounded LRU keyed by the charted values,
+#so repeat results (from any session in the process) skip building and rasterizing the figure.
+def bar_png(new_df,bar_type,result_count):
+    return _bar_png(bar_type,result_count,tuple(new_df.county_state),tuple(map(tuple,new_df[CHART_COLUMNS].to_numpy().tolist())))
+
+#The app draws image charts on workers.chart_executor()'s single thread. Matplotlib is not thread-safe, so calls from anywhere
+#else (the placeholder chart is first drawn on the event loop) still wait for the lock.
+_render_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=128)
+def _bar_png(bar_type,result_count,counties,values):
+    new_df = pd.DataFrame(list(values),columns=CHART_COLUMNS)
+    new_df['county_state'] = counties
+    with _render_lock:
+        return figure_png(bar_figure(new_df,bar_type,result_count))
+
+@functools.lru_cache(maxsize=1)
+def nothing_png():
+    with _render_lock:
+        return figure_png(nothing_fig())
+
+
+### Bokeh chart
+#Only the charted numbers are sent to the browser, which draws the bars itself, so the server never rasterizes anything.
+
+#Function that works out the bottom and top of each bar. Positive values stack upwards and negative values downwards, as pandas does.
+def stack_bars(values):
+    bottoms = np.zeros_like(values)
+    positive_base = np.zeros(len(values),dtype=values.dtype)
+    negative_base = np.zeros(len(values),dtype=values.dtype)
+    for i in range(values.shape[1]):
+        negative = values[:,i] < 0
+        bottoms[:,i] = np.where(negative,negative_base,positive_base)
+        positive_base = np.where(negative,positive_base,positive_base + values[:,i])
+        negative_base = np.where(negative,negative_base + values[:,i],negative_base)
+    return bottoms, bottoms + values
+
+def bokeh_bar(new_df,bar_type,result_count):
+    counties = [str(county) for county in new_df.county_state]
+    values = new_df[CHART_COLUMNS].to_numpy(dtype=float)
+    data = {'county_state': counties}
+    for i, column in enumerate(CHART_COLUMNS):
+        data[column] = values[:,i]
+    if bar_type == 'Stacked':
+        bottoms, tops = stack_bars(values)
+        bar_width = 0.8
+        offsets = [0.0] * len(CHART_COLUMNS)
+    else:
+        bottoms, tops = np.zeros_like(values), values
+        bar_width = 0.8 / len(CHART_COLUMNS)
+        offsets = [(i - (len(CHART_COLUMNS) - 1) / 2) * bar_width for i in range(len(CHART_COLUMNS))]
+    for i, column in enumerate(CHART_COLUMNS):
+        data[f'{column}_bottom'] = bottoms[:,i]
+        data[f'{column}_top'] = tops[:,i]
+        data[f'{column}_x'] = np.arange(len(counties)) + offsets[i]
+    source = ColumnDataSource(data)
+
+    p = figure(width=max(100 * result_count, 400), height=300, x_range=(-.5, len(counties) - .5),
+               toolbar_location=None, tools='', sizing_mode='fixed')
+    for column, label, color in zip(CHART_COLUMNS,CHART_LABELS,CHART_COLORS):
+        renderer = p.vbar(x=f'{column}_x', bottom=f'{column}_bottom', top=f'{column}_top', width=bar_width,
+                          color=color, line_color='black', line_width=0.5, source=source, legend_label=label)
+        p.add_tools(HoverTool(renderers=[renderer], tooltips=[('County', '@county_state'), (label, f'@{column}{{$0,0}}')]))
+    p.xaxis.ticker = list(range(len(counties)))
+    p.xaxis.major_label_overrides = {i: county for i, county in enumerate(counties)}
+    p.xaxis.major_label_orientation = np.pi / 2
+    p.yaxis.formatter = NumeralTickFormatter(format='$0,0')
+    p.xgrid.grid_line_color = None
+    p.ygrid.grid_line_dash = 'dashed'
+    p.ygrid.grid_line_alpha = .4
+    p.legend.items.reverse()
+    p.add_layout(p.legend[0], 'right')
+    return p
@@ -0,0 +1,331 @@
+import argparse
+import datetime
+import email.utils
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from ranking import CostCube
+
+DATA_URL = 'https://files.epi.org/uploads/fbc_data_2024.xlsx'
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SNAPSHOT_NAME = 'fbc_data_2024'
+SNAPSHOT_VERSION = 2 #Bump whenever prepare_data() or the stored layout changes the shape or meaning of the stored columns
+SHARED_VERSION = 3 #Bump whenever compact_table() or the published layout changes
+
+### Reading and preparing the EPI workbook
+
+#Function that fetches the raw workbook bytes, along with the date the source was last modified
+def fetch_workbook(source=DATA_URL):
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source, timeout=60) as response:
+            content = response.read()
+            last_modified = response.headers.get('Last-Modified')
+        if last_modified:
+            source_date = email.utils.parsedate_to_datetime(last_modified).date()
+        else:
+            source_date = datetime.date.today()
+    else:
+        with open(source, 'rb') as f:
+            content = f.read()
+        source_date = datetime.date.fromtimestamp(os.path.getmtime(source))
+    return content, source_date.isoformat()
+
+#Function that turns the raw County sheet into the table used by the app
+def prepare_data(df):
+    #Drop unneeded columns
+    col_to_drop = list(df.columns[:1]) + list(df.columns[13:21])
+    df = df.drop(columns=col_to_drop)
+
+    #One apparently random county is missing median income data, but is still ranked.
+    #By taking the average of the counties ranked immediately above and below it, a quick estimate of $55,122 can be made.
+    df.fillna(55122.0,inplace=True)
+
+    df['median_family_income'] = df['median_family_income'].astype('int64')
+
+    #Add leading zeroes to FIPS codes makes them readable to Tableau.
+    df['county_fips'] = df['county_fips'].astype(str).str.zfill(5)
+
+    df.columns = ['state_abbr','FIPS','county','family','housing','food','transportation','healthcare',
+                  'other_necessities','childcare','taxes','total','median_family_income',
+                  'num_counties_in_st','st_cost_rank','st_med_aff_rank','st_income_rank']
+
+    #Some counties share names across states; adding their state code makes them unique.
+    df['county_state'] = df.county + ', ' + df.state_abbr
+
+    df['median_monthly_family_income'] = df.median_family_income.div(12).round(0).astype('int64')
+
+    df['remaining_money'] = df.median_monthly_family_income - df.total
+    return df
+
+def read_workbook(content):
+    return prepare_data(pd.read_excel(io.BytesIO(content), sheet_name='County', header=1))
+
+
+### Compact table
+#The snapshot keeps every column EPI publishes, but the app only needs these. The app's copy drops the rest, holds the
+#repeated strings as categoricals (a small array of distinct strings plus integer codes), FIPS as an integer and the
+#dollar amounts as int32, which takes about a seventh of the memory of Python strings and int64.
+
+TABLE_COLUMNS = ['state_abbr','FIPS','county','family','housing','food','transportation','healthcare',
+                 'other_necessities','childcare','taxes','total','county_state','median_monthly_family_income','remaining_money']
+STRING_COLUMNS = ['state_abbr','county','family','county_state']
+DOLLAR_DTYPE = np.int32
+
+#Function that returns the compact copy of a prepared table, or of a snapshot's columns.
+#A snapshot's strings are already codes into distinct strings, so no Python string is created per row. Compact columns are kept as they are.
+def compact_table(df):
+    columns = {}
+    for column in TABLE_COLUMNS:
+        values = df[column]
+        if column in STRING_COLUMNS:
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = pd.Categorical(values)
+            columns[column] = values
+        elif column == 'FIPS':
+            values = np.asarray(values)
+            columns[column] = values if values.dtype == np.int32 else values.astype(np.int32) #'01001' becomes 1001
+        else:
+            values = np.asarray(values)
+            if values.dtype != DOLLAR_DTYPE:
+                limits = np.iinfo(DOLLAR_DTYPE)
+                if len(values) and (values.min() < limits.min or values.max() > limits.max):
+                    raise ValueError(f'Column {column} has amounts outside the {limits.dtype} range.')
+                values = values.astype(DOLLAR_DTYPE)
+            columns[column] = values
+    return pd.DataFrame(columns, copy=False)
+
+#Function that returns one row of a compact table with its amounts as int64, so arithmetic with a user's own figures
+#works as it would on the full table instead of overflowing int32
+def table_row(df, row):
+    return df.iloc[row].apply(lambda value: np.int64(value) if isinstance(value, np.integer) else value)
+
+
+### Columnar snapshot
+#The snapshot is a directory holding the columns in one compressed columns.npz plus a meta.json describing where the data came from.
+#String columns are stored as integer codes plus one array of their distinct strings, so no pickling is needed and the whole
+#snapshot is small enough to commit with the app.
+
+def snapshot_path(snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, f'{SNAPSHOT_NAME}.v{SNAPSHOT_VERSION}')
+
+#Function that hashes every column in order, so a truncated or edited snapshot is caught on load
+def columns_checksum(arrays):
+    digest = hashlib.sha256()
+    for name, values in arrays.items():
+        digest.update(name.encode())
+        digest.update(str(values.dtype).encode())
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+#Function that writes the snapshot to a private directory, then renames it into place, so a process reading the snapshot
+#(say another server process starting at the same time) never sees a half-written one.
+#replace=False keeps a snapshot another process has written in the meantime instead of swapping it out under its readers.
+def write_snapshot(df, source, source_date, source_sha256, snapshot_dir=SNAPSHOT_DIR, replace=True):
+    path = snapshot_path(snapshot_dir)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=snapshot_dir, prefix='.writing-')
+    try:
+        meta = write_columns(df, source, source_date, source_sha256, staging)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    move_into_place(staging, path, replace)
+    return meta
+
+def write_columns(df, source, source_date, source_sha256, path):
+    arrays = {}
+    strings = []
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype == object:
+            distinct, codes = np.unique(values.astype(str), return_inverse=True)
+            arrays[f'{column}.codes'] = codes.astype(np.int32)
+            arrays[f'{column}.strings'] = distinct
+            strings.append(column)
+        else:
+            arrays[column] = values
+    np.savez_compressed(os.path.join(path, 'columns.npz'), **arrays)
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'source': source,
+        'source_date': source_date,
+        'source_sha256': source_sha256,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'rows': len(df),
+        'columns': list(df.columns),
+        'strings': strings,
+        'checksum': columns_checksum(arrays),
+    }
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+#Function that renames a finished directory to path. A directory cannot be renamed over another that has files in it,
+#so with replace the old one is moved aside first and deleted after.
+def move_into_place(staging, path, replace=True):
+    retired = None
+    if replace and os.path.exists(path):
+        retired = tempfile.mkdtemp(dir=os.path.dirname(path), prefix='.retired-')
+        try:
+            os.rename(path, os.path.join(retired, 'old'))
+        except OSError: #Another process moved it first
+            pass
+    try:
+        os.rename(staging, path)
+    except OSError: #Another process put the same data in place first
+        shutil.rmtree(staging, ignore_errors=True)
+    if retired is not None:
+        shutil.rmtree(retired, ignore_errors=True)
+
+def read_snapshot_meta(snapshot_dir=SNAPSHOT_DIR):
+    with open(os.path.join(snapshot_path(snapshot_dir), 'meta.json')) as f:
+        return json.load(f)
+
+#Function that reads the snapshot; compact=True returns the compact table the app uses, without building the full one first
+def read_snapshot(snapshot_dir=SNAPSHOT_DIR, verify=True, compact=False):
+    path = snapshot_path(snapshot_dir)
+    meta = read_snapshot_meta(snapshot_dir)
+    if meta['version'] != SNAPSHOT_VERSION:
+        raise ValueError(f'Snapshot at {path} is version {meta["version"]}, expected {SNAPSHOT_VERSION}.')
+    with np.load(os.path.join(path, 'columns.npz'), allow_pickle=False) as stored:
+        arrays = {name: stored[name] for name in stored.files}
+    if verify and columns_checksum(arrays) != meta['checksum']:
+        raise ValueError(f'Snapshot at {path} does not match its checksum; re-run the ingest step.')
+    columns = {}
+    for column in meta['columns']:
+        if column in meta['strings']:
+            strings = arrays[f'{column}.strings'].astype(object)
+            codes = arrays[f'{column}.codes']
+            #The compact table keeps the codes; the full table has one Python string per row, as read_workbook() makes it
+            columns[column] = pd.Categorical.from_codes(codes, categories=strings, validate=False) if compact else strings[codes]
+        else:
+            columns[column] = arrays[column]
+    if compact:
+        return compact_table(columns)
+    return pd.DataFrame(columns)
+
+#Function that downloads and prepares the workbook once, then stores it as a snapshot
+def ingest(source=DATA_URL, snapshot_dir=SNAPSHOT_DIR):
+    content, source_date = fetch_workbook(source)
+    df = read_workbook(content)
+    meta = write_snapshot(df, source, source_date, hashlib.sha256(content).hexdigest(), snapshot_dir)
+    return df, meta
+
+#Function used by the app: loads the snapshot if there is one, otherwise falls back to the workbook and saves a snapshot for next time
+def load_data(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        return read_snapshot(snapshot_dir, compact=True)
+    except FileNotFoundError:
+        pass
+    content, source_date = fetch_workbook()
+    df = read_workbook(content)
+    try:
+        write_snapshot(df, DATA_URL, source_date, hashlib.sha256(content).hexdigest(), snapshot_dir, replace=False)
+    except OSError:
+        pass #A read-only deployment still works, it just keeps downloading on cold start
+    return compact_table(df)
+
+
+### Shared dataset
+#With several server processes (`panel serve --num-procs`, or replicas on one host), each one would otherwise parse the snapshot
+#and hold its own copy of the table and of the cost cube ranked from it. Instead, the first process to start publishes the compact
+#table, already in build_lookups() order, as uncompressed .npy files: numeric columns as they are, and string columns as integer
+#codes plus one small array of distinct strings. The cost cube is published next to it, in cube/. Every process then memory-maps
+#the same files read-only, so the operating system keeps one copy in memory for all of them. Put the directory on a RAM-backed
+#filesystem such as /dev/shm for true shared memory.
+
+#Function that names the published copy after the snapshot's checksum, so new data gets a new directory instead of overwriting one in use
+def shared_path(shared_dir, checksum):
+    return os.path.join(shared_dir, f'{SNAPSHOT_NAME}.v{SNAPSHOT_VERSION}.s{SHARED_VERSION}-{checksum[:16]}')
+
+def publish_shared(df, checksum, shared_dir):
+    path = shared_path(shared_dir, checksum)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return path
+    df, family_rows = build_lookups(compact_table(df))
+    os.makedirs(shared_dir, exist_ok=True)
+    #Written to a private directory, then renamed into place, so other processes never see a half-written copy
+    staging = tempfile.mkdtemp(dir=shared_dir, prefix='.publishing-')
+    strings = []
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            categorical = df[column].array
+            np.save(os.path.join(staging, f'{column}.codes.npy'), categorical.codes, allow_pickle=False)
+            np.save(os.path.join(staging, f'{column}.strings.npy'), categorical.categories.to_numpy().astype(str), allow_pickle=False)
+            strings.append(column)
+        else:
+            np.save(os.path.join(staging, f'{column}.npy'), df[column].to_numpy(), allow_pickle=False)
+    CostCube.from_table(df, family_rows).save(os.path.join(staging, 'cube'))
+    with open(os.path.join(staging, 'meta.json'), 'w') as f:
+        json.dump({'checksum': checksum, 'rows': len(df), 'columns': list(df.columns), 'strings': strings}, f, indent=2)
+    move_into_place(staging, path, replace=False)
+    return path
+
+#Function that maps a published copy into this process and returns the table and its cost cube. Nothing is copied: the columns
+#and the cube's arrays are read-only views of the files, and string columns are categoricals whose codes are the mapped arrays.
+def attach_shared(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    columns = {}
+    for column in meta['columns']:
+        if column in meta['strings']:
+            codes = np.load(os.path.join(path, f'{column}.codes.npy'), mmap_mode='r')
+            strings = np.load(os.path.join(path, f'{column}.strings.npy')).astype(object)
+            columns[column] = pd.Categorical.from_codes(codes, categories=strings, validate=False)
+        else:
+            columns[column] = np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')
+    return pd.DataFrame(columns, copy=False), CostCube.attach(os.path.join(path, 'cube'))
+
+#Function used by the app in shared mode: attaches to the published copy of the current snapshot, publishing it first if no process has yet,
+#and returns the table in build_lookups() order with its cost cube.
+#Without a snapshot (say on a read-only deployment where it cannot be written) the data is loaded privately, as load_data() does.
+def load_shared(shared_dir, snapshot_dir=SNAPSHOT_DIR):
+    try:
+        meta = read_snapshot_meta(snapshot_dir)
+    except FileNotFoundError:
+        df = load_data(snapshot_dir)
+        try:
+            meta = read_snapshot_meta(snapshot_dir)
+        except FileNotFoundError:
+            df, family_rows = build_lookups(df)
+            return df, CostCube.from_table(df, family_rows)
+    path = shared_path(shared_dir, meta['checksum'])
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        path = publish_shared(read_snapshot(snapshot_dir, compact=True), meta['checksum'], shared_dir)
+    return attach_shared(path)
+
+
+### Lookups
+
+#Function that orders the rows so each family type is one contiguous block (counties keep their original order within it),
+#then builds the lookup the app uses instead of scanning the table: family_rows maps a family to the slice holding its counties.
+#A county's row within its family's block comes from CostCube.row(), since every family lists the same counties in the same order.
+def build_lookups(df):
+    families = df.family.to_numpy()
+    if not (families[1:] >= families[:-1]).all(): #A published shared copy is stored in this order already, and must not be copied
+        df = df.sort_values('family', kind='stable').reset_index(drop=True)
+        families = df.family.to_numpy()
+    starts = np.flatnonzero(np.r_[True, families[1:] != families[:-1]])
+    ends = np.r_[starts[1:], len(df)]
+    family_rows = {families[start]: slice(int(start), int(end)) for start, end in zip(starts, ends)}
+    return df, family_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the EPI family budget workbook into a local snapshot for the app.')
+    parser.add_argument('--source', default=DATA_URL, help='URL or path of the EPI workbook (default: %(default)s)')
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR, help='Directory the snapshot is written to (default: %(default)s)')
+    parser.add_argument('--publish-shared', metavar='SHARED_DIR', help='Also publish the data to SHARED_DIR for app processes started with SHARED_DATA_DIR')
+    args = parser.parse_args()
+    df, meta = ingest(args.source, args.snapshot_dir)
+    print(f'Wrote {meta["rows"]} rows from {meta["source"]} (dated {meta["source_date"]}) to {snapshot_path(args.snapshot_dir)}')
+    if args.publish_shared:
+        print(f'Published the data for shared use at {publish_shared(df, meta["checksum"], args.publish_shared)}')
@@ -0,0 +1,81 @@
+import bisect
+import re
+import unicodedata
+
+#Spellings that are treated as the same word, and words that can be left out, when matching county names
+ABBREVIATIONS = {'st': 'saint', 'ste': 'sainte', 'mt': 'mount', 'ft': 'fort'}
+OPTIONAL_WORDS = {'county', 'parish', 'borough'}
+
+#Function that splits text into plain lowercase ASCII words
+def plain_words(text):
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower().replace("'", '')
+    return re.findall(r'[a-z0-9]+', text)
+
+#Function that reduces a county name or query to comparable words, so "St. Louis County, MO" and "saint louis mo" match
+def normalize_words(text):
+    words = [ABBREVIATIONS.get(word, word) for word in plain_words(text)]
+    return [word for word in words if word not in OPTIONAL_WORDS]
+
+
+#Prefix index over county names, built once per process.
+#Every name is stored under its normalized key, and under each word-start suffix of that key, in sorted lists,
+#so a query is a bisect plus a short scan instead of a pass over every county.
+class CountySearch:
+    def __init__(self, names):
+        self.names = list(dict.fromkeys(names))
+        self.name_set = set(self.names)
+        self.by_key = {}
+        name_entries = []
+        word_entries = []
+        for i, name in enumerate(self.names):
+            words = normalize_words(name)
+            key = ' '.join(words)
+            self.by_key.setdefault(key, name)
+            name_entries.append((key, i))
+            for start in range(1, len(words)):
+                word_entries.append((' '.join(words[start:]), i))
+        name_entries.sort()
+        word_entries.sort()
+        self.name_keys = [key for key, i in name_entries]
+        self.name_ids = [i for key, i in name_entries]
+        self.word_keys = [key for key, i in word_entries]
+        self.word_ids = [i for key, i in word_entries]
+
+    def __contains__(self, name):
+        return name in self.name_set
+
+    #Function that lists the ways a query could be meant. The last word may still be being typed, so it is also tried
+    #as written ("st" could be the start of "Stark"), and left out when it could be the start of an optional word ("coun").
+    def query_variants(self, query):
+        variants = [' '.join(normalize_words(query))]
+        last_word = re.search(r'[^\W_]+$', query)
+        if last_word:
+            head = normalize_words(query[:last_word.start()])
+            last = plain_words(last_word.group())
+            variants.append(' '.join(head + last))
+            if last and any(word.startswith(last[0]) for word in OPTIONAL_WORDS):
+                variants.append(' '.join(head))
+        return [variant for variant in dict.fromkeys(variants) if variant]
+
+    #Function that returns up to limit county names matching the query: names starting with it first, then names with a later word starting with it
+    def search(self, query, limit=10):
+        found = []
+        for keys, ids in [(self.name_keys, self.name_ids), (self.word_keys, self.word_ids)]:
+            for variant in self.query_variants(query):
+                position = bisect.bisect_left(keys, variant)
+                while position < len(keys) and keys[position].startswith(variant) and len(found) < limit:
+                    name = self.names[ids[position]]
+                    if name not in found:
+                        found.append(name)
+                    position += 1
+        return found
+
+    #Function that turns typed text into a county name from the data, or None if it does not pick out exactly one county
+    def resolve(self, text):
+        if text in self.name_set:
+            return text
+        key = ' '.join(normalize_words(text))
+        if key in self.by_key:
+            return self.by_key[key]
+        matches = self.search(text, limit=2)
+        return matches[0] if len(matches) == 1 else None
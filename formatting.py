@@ -0,0 +1,72 @@
+#Results are shown a page at a time; further pages are only formatted when asked for
+RESULTS_PAGE_SIZE = 10
+
+#Fields listed for each county in the results, in display order
+RESULT_FIELDS = [['housing','Housing'],['food','Food'],['transportation','Transportation'],['healthcare','Healthcare'],
+                 ['childcare','Childcare'],['other_necessities','Other necessities'],['taxes','Taxes'],['total','Total'],
+                 ['median_monthly_family_income','Income'],['remaining_money','Remaining money']]
+
+#Function to represent data in US dollars
+def dol(amount):
+    return '${:0,}'.format(amount)
+
+#Function that formats a whole column at once, instead of looking values up row by row
+def dol_column(values):
+    return ['${:0,}'.format(amount) for amount in values.tolist()]
+
+#Function that writes the lines above the results. limit is how many counties will be listed in total.
+def results_header(limit,result_count,bring_income,income_cap,income_cap_amount):
+    county_results = []
+    if limit < result_count:
+        county_results.append(f'There are only {limit} counties to show!\n\n')
+    if limit == 1:
+        second_line = 'here is the most affordable county for your family, along with what your budget might look living there:\n'
+    else:
+        second_line = f'here are the {limit} most affordable counties for your family, along with what your budget might look living there:\n'
+    if not bring_income and not income_cap:
+        county_results.append("With both your spending and income recalculated based on each county's norm, "
+                             + second_line)
+    elif bring_income:
+        county_results.append("With your exact income maintained but your spending recalculated based on each county's norm, "
+                          + second_line)
+    else:
+        county_results.append(f"With both your spending and income recalculated based on each county's norm (and an income cap of ${income_cap_amount:,.0f}), "
+                          + second_line)
+    return '\n'.join(county_results)
+
+#Function that formats one page of ranked counties. start is the rank of the first row, counting from 0.
+#Each field is formatted for the whole page in one pass, then the rows are stitched together.
+def format_results(new_df,start,income_cap):
+    fields = [[f'\n#{start+i+1}\n{county}' for i, county in enumerate(new_df.county_state.tolist())]]
+    for column, label in RESULT_FIELDS:
+        lines = [f"&nbsp;&nbsp;&nbsp;&nbsp;{label}: {amount}" for amount in dol_column(new_df[column])]
+        if column == 'median_monthly_family_income' and income_cap == True:
+            capped = (new_df.median_monthly_family_income_uncapped > new_df.median_monthly_family_income).tolist()
+            uncapped = dol_column(new_df.median_monthly_family_income_uncapped)
+            lines = [f'{line} (Uncapped: {amount})' if is_capped else line for line, amount, is_capped in zip(lines,uncapped,capped)]
+        fields.append(lines)
+    return '\n'.join('\n'.join(row) for row in zip(*fields))
+
+#Sweeps list at most this many ranges; the rest can be seen by narrowing the sweep
+SWEEP_MAX_RANGES = 50
+
+#Function that describes a sweep: each range of values over which the top counties stay the same, with those counties.
+#changes holds the top counties at each breakpoint, as Sweep.breakpoints() and Sweep.frame() return them.
+def format_sweep(changes,start,stop,label):
+    starts = sorted(set(changes.value.tolist())) or [start]
+    ends = [value - 1 for value in starts[1:]] + [stop]
+    lines = [f'Between {dol(start)} and {dol(stop)}, the most affordable counties change {len(starts) - 1} '
+             f'{"time" if len(starts) == 2 else "times"}. Remaining money is shown at the start of each range.']
+    by_value = {value: rows for value, rows in changes.groupby('value')}
+    for range_start, range_end in list(zip(starts,ends))[:SWEEP_MAX_RANGES]:
+        values = dol(range_start) if range_start == range_end else f'{dol(range_start)} to {dol(range_end)}'
+        lines.append(f'\n**{label} {values}**')
+        rows = by_value.get(range_start)
+        if rows is None:
+            lines.append('&nbsp;&nbsp;&nbsp;&nbsp;No counties meet the constraints.')
+            continue
+        for rank, county, remaining in zip(rows['rank'].tolist(),rows.county_state.tolist(),dol_column(rows.remaining_money)):
+            lines.append(f'&nbsp;&nbsp;&nbsp;&nbsp;#{rank} {county}: {remaining} remaining')
+    if len(starts) > SWEEP_MAX_RANGES:
+        lines.append(f'\nShowing the first {SWEEP_MAX_RANGES} of {len(starts)} ranges. Narrow the sweep to see the rest.')
+    return '\n'.join(lines)
@@ -0,0 +1,188 @@
+import cProfile
+import contextlib
+import http.server
+import os
+import re
+import threading
+import time
+
+#Latency histograms for data loading, session setup and every result callback, kept per process.
+#They can be scraped in the Prometheus text format from a local HTTP endpoint, and calls slower than a threshold
+#can have a cProfile trace written to disk. Both are off unless their environment variable is set:
+#  METRICS_PORT         port for http://127.0.0.1:<port>/metrics; with several worker processes, each takes the next free port
+#  METRICS_PORTS        how many ports from METRICS_PORT the workers may take, one each (default 16)
+#  METRICS_PROFILE_DIR  directory for .prof files of slow calls (open with pstats or snakeviz)
+#  METRICS_SLOW_MS      what counts as slow, in milliseconds (default 1000)
+
+METRIC_NAME = 'affordable_county_call_seconds'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LABEL_NAMES = ('call', 'result_count', 'states')
+
+#Sizes are reported in ranges, so the number of series stays small whatever users type
+RESULT_COUNT_RANGES = [(5, '1-5'), (10, '6-10'), (50, '11-50'), (500, '51-500')]
+STATE_COUNT_RANGES = [(1, '1'), (5, '2-5'), (10, '6-10')]
+
+def size_label(count, ranges, top_label):
+    for high, label in ranges:
+        if count <= high:
+            return label
+    return top_label
+
+def result_count_label(result_count):
+    if result_count is None:
+        return ''
+    return size_label(result_count, RESULT_COUNT_RANGES, '501+')
+
+def states_label(include_all_states, states_allowed):
+    if include_all_states:
+        return 'all'
+    return size_label(len(states_allowed), STATE_COUNT_RANGES, '11+')
+
+
+### Histograms
+
+#Cumulative bucket counts, sums and counts per label set. Calls can come from any thread, so updates take a lock.
+class Histograms:
+    def __init__(self, name, buckets=BUCKETS, label_names=LABEL_NAMES):
+        self.name = name
+        self.buckets = buckets
+        self.label_names = label_names
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, labels):
+        with self.lock:
+            counts = self.series.setdefault(labels, [0] * (len(self.buckets) + 2)) #Buckets, then +Inf count, then sum
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += seconds
+
+    #Function that writes every series in the Prometheus text exposition format
+    def exposition(self):
+        lines = [f'# HELP {self.name} Time spent loading data, setting up sessions and answering each callback.',
+                 f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {labels: list(counts) for labels, counts in self.series.items()}
+        for labels, counts in sorted(series.items()):
+            label_text = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(self.label_names, labels))
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {counts[-2]}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {counts[-1]:.6f}')
+            lines.append(f'{self.name}_count{{{label_text}}} {counts[-2]}')
+        return lines
+
+def escape_label(value):
+    return re.sub(r'(["\\])', r'\\\1', str(value)).replace('\n', r'\n')
+
+histograms = Histograms(METRIC_NAME)
+
+#Extra lines for the endpoint, such as cache counters, added by whoever owns the numbers
+collectors = []
+
+def add_collector(collector):
+    collectors.append(collector)
+
+def exposition():
+    lines = histograms.exposition()
+    for collector in collectors:
+        lines.extend(collector())
+    return '\n'.join(lines) + '\n'
+
+
+### Timing calls
+
+SLOW_MS = float(os.environ.get('METRICS_SLOW_MS', 1000))
+PROFILE_DIR = os.environ.get('METRICS_PROFILE_DIR')
+
+#Function that records a time measured elsewhere, such as session setup, which cannot be wrapped in a with block
+def record(call, seconds, result_count='', states=''):
+    histograms.observe(seconds, (call, result_count, states))
+
+#Only the outermost timed call on a thread is profiled, since a thread can only run one profiler at a time
+_active = threading.local()
+
+#Function that times the enclosed block (or, used as a decorator, the function) and records it under call, with the input sizes given.
+#result_count and states are labels such as result_count_label() and states_label() return; '' when they do not apply.
+#Blocks that await other work on the event loop should pass profile=False, since a profile would include every other session's callbacks.
+@contextlib.contextmanager
+def timed(call, result_count='', states='', profile=True):
+    profiler = None
+    if PROFILE_DIR and profile and not getattr(_active, 'profiling', False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            _active.profiling = True
+        except ValueError: #Another profiler is already running on this thread
+            profiler = None
+    start = time.perf_counter()
+    completed = False
+    try:
+        yield
+        completed = True
+    except Exception:
+        completed = True #Failed calls still took the time; only calls cancelled because a newer request replaced them are left out
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        if completed:
+            record(call, seconds, result_count, states)
+        if profiler is not None:
+            profiler.disable()
+            _active.profiling = False
+            if seconds * 1000 >= SLOW_MS:
+                dump_profile(profiler, call, seconds)
+
+def dump_profile(profiler, call, seconds):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f'{call}-{stamp}-{threading.get_ident()}-{seconds * 1000:.0f}ms.prof'))
+
+
+### Endpoint
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): #Scrapes would otherwise be logged to stderr every few seconds
+        pass
+
+_server = None #False once starting has failed, so later sessions do not retry
+_server_lock = threading.Lock()
+
+PORT_COUNT = int(os.environ.get('METRICS_PORTS', 16))
+
+#Function that starts the endpoint on a background thread, once per process. port defaults to METRICS_PORT; without either, nothing starts.
+#Each process takes the first free port from port up, so with `panel serve --num-procs N` the workers serve on port to port + N - 1
+#and each can be scraped as its own target. If every port in the range is taken the endpoint is skipped and the app carries on.
+def serve_metrics(port=None, host='127.0.0.1', port_count=PORT_COUNT):
+    global _server
+    port = port if port is not None else os.environ.get('METRICS_PORT')
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            for offset in range(max(1, port_count)):
+                try:
+                    _server = http.server.ThreadingHTTPServer((host, int(port) + offset), MetricsHandler)
+                    break
+                except OSError as error:
+                    failure = error
+            else:
+                print(f'Metrics endpoint not started on {host}:{port} or the {port_count - 1} ports after it: {failure}')
+                _server = False
+                return None
+            threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
+            print(f'Metrics for process {os.getpid()} at http://{host}:{_server.server_address[1]}/metrics')
+    return _server or None
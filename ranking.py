@@ -0,0 +1,318 @@
+import collections
+import concurrent.futures
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+#Budget columns in the order the app asks for them
+BUDGET_COLUMNS = ['housing','food','transportation','healthcare','childcare','other_necessities','taxes']
+
+#Function to calculate the user budget's comparison to the model. Accounts for dividing by zero.
+def calculate_percentage(user_value,model_value):
+    if model_value == 0:
+        return 1.0
+    else:
+        return 1+round(((user_value-model_value)/model_value),3)
+
+#Function that compares a user's income and budget (in BUDGET_COLUMNS order) to the model row for their county and family
+def budget_ratios(user_row,user_income,user_budget):
+    income_p = calculate_percentage(user_income,user_row.median_monthly_family_income)
+    budget_p = tuple(calculate_percentage(value,user_row[column]) for value, column in zip(user_budget,BUDGET_COLUMNS))
+    return income_p, budget_p
+
+#Function that returns the positions of the k largest values, largest first.
+#Ties keep their original order, the same as a stable descending sort, but only the values that can make the top k get sorted.
+def top_positions(values,k):
+    if k >= len(values):
+        return np.argsort(-values,kind='stable')
+    if k <= 0:
+        return np.empty(0,dtype=np.intp)
+    kth_largest = np.partition(values,len(values)-k)[len(values)-k]
+    candidates = np.flatnonzero(values >= kth_largest)
+    return candidates[np.argsort(-values[candidates],kind='stable')[:k]]
+
+#Function that returns, for every row of remaining, the columns of its k largest allowed values, largest first.
+#Ties go to the smaller tiebreak (a county's position, all below tiebreak_count), as in top_positions.
+#Also returns which of those columns are allowed, since rows with fewer than k allowed columns are filled out with others.
+def top_in_rows(remaining,allowed,tiebreak,tiebreak_count,k):
+    columns = remaining.shape[1]
+    n = min(k,columns)
+    if n <= 0:
+        empty = np.empty((remaining.shape[0],0),dtype=np.intp)
+        return empty, empty.astype(bool)
+    #Larger key = more remaining money, then earlier county; excluded counties get the smallest possible key
+    key = np.where(allowed,remaining * tiebreak_count - tiebreak,np.iinfo(np.int64).min)
+    selected = np.argpartition(key,columns - n,axis=1)[:,columns - n:]
+    order = np.argsort(np.take_along_axis(key,selected,axis=1),axis=1)[:,::-1]
+    top = np.take_along_axis(selected,order,axis=1)
+    return top, np.take_along_axis(allowed,top,axis=1)
+
+
+#Function that applies the constraints on rescaled values. Works on arrays of any matching shape; None or NaN turns a constraint off.
+#The housing share is a fraction of the (capped) income, and counties without positive income never meet it.
+def constraint_mask(housing,total,income,remaining,min_remaining=None,max_housing_share=None,max_total=None):
+    keep = np.ones(np.shape(remaining),dtype=bool)
+    if min_remaining is not None:
+        keep &= np.isnan(min_remaining) | (remaining >= min_remaining)
+    if max_housing_share is not None:
+        keep &= np.isnan(max_housing_share) | ((income > 0) & (housing <= max_housing_share * income))
+    if max_total is not None:
+        keep &= np.isnan(max_total) | (total <= max_total)
+    return keep
+
+
+#The county table as dense arrays: costs[family, county, category] with categories in BUDGET_COLUMNS order,
+#income[family, county], and per-county name and state vectors shared by every family.
+#from_table() builds one from the table; attach() maps one saved by save(), so server processes sharing a published copy
+#read the same arrays instead of each stacking its own.
+class CostCube:
+    def __init__(self,families,costs,income,county_state,county,state_abbr,fips):
+        self.families = list(families)
+        self.family_index = {family: i for i, family in enumerate(self.families)}
+        self.county_state = county_state
+        self.county_index = {county: i for i, county in enumerate(county_state.tolist())}
+        self.county = county
+        self.state_abbr = state_abbr
+        self.states = list(dict.fromkeys(state_abbr.tolist())) #In data order, for the state picker
+        self.fips = fips
+        #Amounts are kept as int32 like the table, since every use multiplies them by a float ratio first
+        self.costs = costs
+        self.income = income
+        #One row bitmask per state, so state filters are boolean ORs instead of string comparisons
+        self.state_masks = {state: state_abbr == state for state in self.states}
+
+    @classmethod
+    def from_table(cls,df,family_rows):
+        families = sorted(family_rows,key=lambda family: family_rows[family].start)
+        first = family_rows[families[0]]
+        counties = df.county_state.to_numpy()
+        for family in families:
+            if not np.array_equal(counties[family_rows[family]],counties[first]):
+                raise ValueError(f'Family {family} does not list the same counties, in the same order, as {families[0]}.')
+        fips = df.FIPS.to_numpy()[first]
+        #The compact table holds FIPS as integers; results show them as five-digit codes
+        fips = np.char.zfill(fips.astype(str),5).astype(object) if fips.dtype.kind in 'iu' else fips
+        costs = np.stack([df[BUDGET_COLUMNS].to_numpy(dtype=np.int32)[family_rows[family]] for family in families])
+        income = np.stack([df.median_monthly_family_income.to_numpy(dtype=np.int32)[family_rows[family]] for family in families])
+        return cls(families,costs,income,counties[first],df.county.to_numpy()[first],df.state_abbr.to_numpy()[first],fips)
+
+    #Function that writes the arrays to a directory as .npy files, strings as fixed-width unicode so they can be memory-mapped
+    def save(self,path):
+        os.makedirs(path,exist_ok=True)
+        arrays = {'families': self.families,'costs': self.costs,'income': self.income,'county_state': self.county_state,
+                  'county': self.county,'state_abbr': self.state_abbr,'fips': self.fips}
+        for name, values in arrays.items():
+            values = np.asarray(values)
+            np.save(os.path.join(path,f'{name}.npy'),values.astype(str) if values.dtype == object else values,allow_pickle=False)
+
+    #Function that maps a cube written by save(). Nothing is copied: every array is a read-only view of its file.
+    @classmethod
+    def attach(cls,path):
+        arrays = {name: np.load(os.path.join(path,f'{name}.npy'),mmap_mode='r')
+                  for name in ['costs','income','county_state','county','state_abbr','fips']}
+        families = np.load(os.path.join(path,'families.npy')).tolist()
+        return cls(families,**arrays)
+
+    #Function that returns the table row of a county for a family, or None if either is unknown. The table lists each family's
+    #counties in the cube's order, one family after another, so this needs no lookup per row.
+    def row(self,county_state,family):
+        county = self.county_index.get(county_state)
+        family = self.family_index.get(family)
+        if county is None or family is None:
+            return None
+        return family * len(self.county_state) + county
+
+    #Function that returns a mask of the counties in any of the given states; None means every state
+    def state_mask(self,states=None):
+        if states is None:
+            return np.ones(len(self.county_state),dtype=bool)
+        mask = np.zeros(len(self.county_state),dtype=bool)
+        for state in states:
+            if state in self.state_masks:
+                mask |= self.state_masks[state]
+        return mask
+
+    #Function that returns the positions of the counties that pass the filters needing no arithmetic, in county order
+    def candidates(self,states=None,exclude_county=None):
+        if states is None and exclude_county is None:
+            return np.arange(len(self.county_state))
+        mask = self.state_mask(states)
+        if exclude_county is not None:
+            mask[self.county_index[exclude_county]] = False
+        return np.flatnonzero(mask)
+
+    #Function that returns what to index a family's counties with to get the given candidates: a slice when they are every county,
+    #so the costs are read through a view instead of being copied
+    def selector(self,positions):
+        return slice(None) if len(positions) == len(self.county_state) else positions
+
+
+#One family's counties with the user's budget and income rescaled to each of them. Positions index the cube's counties.
+class Ranking:
+    def __init__(self,cube,positions,costs,income,uncapped_income):
+        self.cube = cube
+        self.positions = positions
+        self.costs = costs
+        self.total = costs.sum(axis=1)
+        self.income = income
+        self.uncapped_income = uncapped_income
+        self.remaining_money = income - self.total
+        self.count = len(positions)
+        self.nbytes = sum(values.nbytes for values in [positions,costs,self.total,income,uncapped_income,self.remaining_money])
+
+    #Function that returns the k most affordable counties as a new frame, most affordable first
+    def top(self,k):
+        return self.page(0,k)
+
+    #Function that returns the counties ranked start to stop (counting from 0) as a new frame. Only the best stop counties are sorted.
+    def page(self,start,stop):
+        order = top_positions(self.remaining_money,stop)[start:]
+        counties = self.positions[order]
+        columns = {
+            'state_abbr': self.cube.state_abbr[counties],
+            'FIPS': self.cube.fips[counties],
+            'county': self.cube.county[counties],
+            'county_state': self.cube.county_state[counties],
+        }
+        for i, column in enumerate(BUDGET_COLUMNS):
+            columns[column] = self.costs[order,i]
+        columns['total'] = self.total[order]
+        columns['median_monthly_family_income'] = self.income[order]
+        columns['median_monthly_family_income_uncapped'] = self.uncapped_income[order]
+        columns['remaining_money'] = self.remaining_money[order]
+        return pd.DataFrame(columns)
+
+
+CacheInfo = collections.namedtuple('CacheInfo',['hits','misses','maxbytes','currsize','nbytes'])
+
+#Least-recently-used cache of rankings, bounded by the bytes their arrays hold rather than by how many there are,
+#since a ranking of every county is hundreds of times the size of one of a single state. Calls can come from any thread.
+class RankingCache:
+    def __init__(self,maxbytes):
+        self.maxbytes = maxbytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    #Function that returns the cached ranking for key, or None
+    def get(self,key):
+        with self.lock:
+            return self.entries.get(key)
+
+    #Function that records whether a lookup was served without computing the ranking, and marks a cached key as recently used
+    def count(self,key,hit):
+        with self.lock:
+            if not hit:
+                self.misses += 1
+                return
+            self.hits += 1
+            if key in self.entries:
+                self.entries.move_to_end(key)
+
+    def put(self,key,ranking):
+        with self.lock:
+            if key in self.entries or ranking.nbytes > self.maxbytes:
+                return
+            self.entries[key] = ranking
+            self.nbytes += ranking.nbytes
+            while self.nbytes > self.maxbytes:
+                self.nbytes -= self.entries.popitem(last=False)[1].nbytes
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits,self.misses,self.maxbytes,len(self.entries),self.nbytes)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+#Ranks every county for a family by the money left over once the user's budget and income are rescaled to it.
+#Results are cached per process in an LRU keyed by the normalized inputs, so the results list and the bar chart
+#share one computation, and repeat profiles from any session are served from the cache.
+#The cache holds at most maxbytes of rankings: the default of 16 MiB is about 50 rankings of every county (each around
+#300 KB with all of the country's 3,143) and many more of a few states.
+#A ranking that is still being computed is not started again: the results list and the bar chart are computed on
+#separate threads for one click, and the second waits for the first's ranking instead of repeating it.
+#Cached rankings are shared between callers and must be treated as read-only.
+class RankingEngine:
+    def __init__(self,cube,maxbytes=16 * 2**20):
+        self.cube = cube
+        self.cache = RankingCache(maxbytes)
+        self.pending = {} #Key -> Future of a ranking being computed
+        self.pending_lock = threading.Lock()
+
+    #Function that normalizes the inputs, so settings that do not affect the result do not split the cache.
+    #The optional constraints are off when None; exclude_county is a county_state name.
+    def rank(self,user_family,income_p,budget_p,bring_income,user_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+             min_remaining=None,max_housing_share=None,max_total=None,exclude_county=None):
+        return self._ranked(
+            user_family,
+            None if bring_income else float(income_p),
+            int(user_income) if bring_income else None,
+            tuple(float(p) for p in budget_p),
+            int(income_cap_amount) if income_cap else None,
+            None if include_all_states else tuple(sorted(set(states_allowed))),
+            None if min_remaining is None else int(min_remaining),
+            None if max_housing_share is None else float(max_housing_share),
+            None if max_total is None else int(max_total),
+            exclude_county,
+        )
+
+    def cache_info(self):
+        return self.cache.info()
+
+    def cache_clear(self):
+        self.cache.clear()
+
+    def _ranked(self,*key):
+        #Looked up under the lock, so a ranking is always either cached or pending while it is being put in the cache
+        with self.pending_lock:
+            ranking = self.cache.get(key)
+            future = self.pending.get(key) if ranking is None else None
+            computing = ranking is None and future is None
+            if computing:
+                future = self.pending[key] = concurrent.futures.Future()
+        self.cache.count(key,not computing)
+        if ranking is not None:
+            return ranking
+        if not computing:
+            return future.result()
+        try:
+            ranking = self._rank(*key)
+            self.cache.put(key,ranking)
+            future.set_result(ranking)
+            return ranking
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self.pending_lock:
+                del self.pending[key]
+
+    def _rank(self,user_family,income_p,fixed_income,budget_p,income_cap_amount,states,min_remaining,max_housing_share,max_total,exclude_county):
+        cube = self.cube
+        family = cube.family_index[user_family]
+        #Filters that need no arithmetic run first, so the rescaling below only touches candidate counties
+        positions = cube.candidates(states,exclude_county)
+        rows = cube.selector(positions)
+        #One broadcast multiply rescales every category for every county; rounding matches pandas' round(0)
+        costs = np.rint(cube.costs[family,rows] * np.array(budget_p)).astype(np.int64)
+        if fixed_income is not None:
+            uncapped_income = np.full(len(positions),fixed_income,dtype=np.int64)
+        else:
+            uncapped_income = np.rint(cube.income[family,rows] * income_p).astype(np.int64)
+        if income_cap_amount is not None:
+            income = np.minimum(uncapped_income,income_cap_amount)
+        else:
+            income = uncapped_income
+        if min_remaining is not None or max_housing_share is not None or max_total is not None:
+            total = costs.sum(axis=1)
+            keep = constraint_mask(costs[:,BUDGET_COLUMNS.index('housing')],total,income,income - total,min_remaining,max_housing_share,max_total)
+            positions, costs, income, uncapped_income = positions[keep], costs[keep], income[keep], uncapped_income[keep]
+        return Ranking(cube,positions,costs,income,uncapped_income)
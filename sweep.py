@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+
+from batch import calculate_percentages
+from ranking import BUDGET_COLUMNS, constraint_mask, top_in_rows
+
+#What a sweep can vary: the income cap amount (the cap is applied at every value), or the user's monthly income
+SWEEP_VARIABLES = ['income_cap','income']
+
+SWEEP_COLUMNS = ['value','rank','county_state','state_abbr','FIPS','county','total','median_monthly_family_income','remaining_money']
+
+#Most values one sweep ranks at once, about half a second of one worker thread in the worst case, so a single sweep cannot hold up the pool.
+#A rescaled-income sweep ranks every distinct income ratio in its range, and a grid ranks every grid value.
+MAX_RANKED_VALUES = 5000
+
+#Function that returns the sorted grid from start to stop in steps of step, always including stop
+def sweep_grid(start,stop,step):
+    if stop < start or step <= 0:
+        raise ValueError('A sweep needs start <= stop and a positive step.')
+    if (stop - start) // step + 1 > MAX_RANKED_VALUES:
+        raise ValueError(f'A sweep grid can have at most {MAX_RANKED_VALUES:,} values; use a larger step or a narrower range.')
+    return np.unique(np.r_[np.arange(start,stop,step,dtype=np.int64),stop])
+
+
+#Sweeps one setting over a range for a single user, ranking every county at many values of it in a few array operations.
+#Everything that does not depend on the swept value (the rescaled costs, the candidate counties) is computed once.
+#Rankings use the same rounding, constraints and tie-break (county order) as RankingEngine, so every value gives the list the app would show.
+class Sweep:
+    def __init__(self,cube,user_family,income_p,budget_p,bring_income,user_income,income_cap,income_cap_amount,include_all_states,states_allowed,
+                 min_remaining=None,max_housing_share=None,max_total=None,exclude_county=None,model_income=None,variable='income_cap',top_n=5,chunk_size=256):
+        if variable not in SWEEP_VARIABLES:
+            raise ValueError(f'Unknown sweep variable {variable!r}; expected one of {", ".join(SWEEP_VARIABLES)}.')
+        if variable == 'income' and not bring_income and model_income is None:
+            raise ValueError('An income sweep needs the model income of the user\'s county to rescale income.')
+        family = cube.family_index[user_family]
+        self.cube = cube
+        self.variable = variable
+        self.bring_income = bring_income
+        self.model_income = model_income
+        self.top_n = top_n
+        self.chunk_size = chunk_size
+        self.positions = cube.candidates(None if include_all_states else tuple(sorted(set(states_allowed))),exclude_county)
+        rows = cube.selector(self.positions)
+        costs = np.rint(cube.costs[family,rows] * np.array(budget_p)).astype(np.int64)
+        self.total = costs.sum(axis=1)
+        self.housing = costs[:,BUDGET_COLUMNS.index('housing')]
+        self.county_income = cube.income[family,rows]
+        self.income_p = float(income_p)
+        self.user_income = int(user_income)
+        self.income_cap_amount = int(income_cap_amount) if income_cap else None
+        self.limits = (min_remaining,max_housing_share,max_total)
+
+    #Function that returns the (capped) income at each value for counties with the given median incomes.
+    #values and county_income can be any shapes that broadcast together, e.g. a column of values against a row of counties.
+    def income(self,values,county_income):
+        if self.variable == 'income_cap':
+            if self.bring_income:
+                uncapped = np.full(np.shape(county_income),self.user_income,dtype=np.int64)
+            else:
+                uncapped = np.rint(county_income * self.income_p).astype(np.int64)
+            return np.minimum(uncapped,values)
+        if self.bring_income:
+            uncapped = values
+        else:
+            income_p = calculate_percentages(values,np.full(np.shape(values),self.model_income))
+            uncapped = np.rint(county_income * income_p).astype(np.int64)
+        if self.income_cap_amount is None:
+            return uncapped
+        return np.minimum(uncapped,self.income_cap_amount)
+
+    #Function that returns the top_n candidate indexes (into self.positions) at each value, best first, padded with -1.
+    #contenders limits the ranking to some candidates, when the others are known never to make the top_n.
+    def top(self,values,contenders=None):
+        if contenders is None:
+            contenders = np.arange(len(self.positions))
+        tops = [self._top(values[start:start + self.chunk_size],contenders) for start in range(0,len(values),self.chunk_size)]
+        return np.concatenate(tops) if tops else np.empty((0,self.top_n),dtype=np.int64)
+
+    def _top(self,values,contenders):
+        income = self.income(np.asarray(values,dtype=np.int64)[:,None],self.county_income[None,contenders])
+        total = self.total[None,contenders]
+        remaining = income - total
+        allowed = constraint_mask(self.housing[None,contenders],total,income,remaining,*self.limits)
+        top, valid = top_in_rows(remaining,allowed,contenders,len(self.positions),self.top_n)
+        top = np.where(valid,contenders[top],-1)
+        return np.pad(top,((0,0),(0,self.top_n - top.shape[1])),constant_values=-1)
+
+    #Function that returns every value in [start, stop] at which the top_n list differs from the one at the value just below,
+    #with the list at start, as (values, lists).
+    def breakpoints(self,start,stop):
+        if self.variable == 'income' and not self.bring_income:
+            return self._enumerated_breakpoints(start,stop)
+        return self._bisected_breakpoints(start,stop)
+
+    #Rescaled income depends on the income ratio, which is rounded to 0.001, so only the incomes where the ratio
+    #changes can change the ranking. Each distinct ratio is ranked once.
+    def _enumerated_breakpoints(self,start,stop):
+        #The ratio moves by 0.001 every model_income / 1000 dollars, so this counts the ratios without listing the incomes first
+        ratio_count = (stop - start) * 1000 // self.model_income + 1 if self.model_income > 0 else 1
+        if ratio_count > MAX_RANKED_VALUES:
+            span = MAX_RANKED_VALUES * self.model_income // 1000
+            raise ValueError(f'An income sweep can cover at most ${span:,} here ({MAX_RANKED_VALUES:,} income ratios); narrow the range.')
+        incomes = np.arange(start,stop + 1,dtype=np.int64)
+        ratios = calculate_percentages(incomes,np.full(len(incomes),self.model_income))
+        firsts = incomes[np.r_[True,ratios[1:] != ratios[:-1]]]
+        tops = self.top(firsts,self.contenders(firsts[0],ratios[0],ratios[-1]))
+        changed = np.r_[True,(tops[1:] != tops[:-1]).any(axis=1)]
+        return firsts[changed], tops[changed]
+
+    #Function that returns the candidates that could make the top_n for some income ratio between low and high, the ratio at income start.
+    #Money left over is rint(county income * ratio) - total, which is within 1 of a straight line in the ratio (capped, if there is a cap).
+    #The top_n counties at start stay eligible as the ratio rises, so any county whose best case is below all of their worst cases
+    #at both ends of the range is below them throughout it (their lowest worst case is concave) and is left out.
+    def contenders(self,start,low,high):
+        leaders = self.top(np.array([start],dtype=np.int64))[0]
+        if self.top_n == 0 or (leaders < 0).any():
+            return None
+        cap = np.inf if self.income_cap_amount is None else self.income_cap_amount
+        beaten = []
+        for ratio in [low,high]:
+            line = self.county_income * ratio - self.total
+            floor = np.min(np.minimum(line[leaders] - 1,cap - self.total[leaders]))
+            beaten.append((line + 1 < floor,cap - self.total < floor))
+        (line_low, cap_low), (line_high, cap_high) = beaten
+        return np.flatnonzero(~((line_low & line_high) | (cap_low & cap_high)))
+
+    #Here each county's money left over moves steadily one way as the value rises, so once one county passes another it stays
+    #ahead, and a list that is the same at both ends of a range is the same throughout it. Ranges whose ends differ are halved
+    #until each change is pinned to a single dollar; all ranges at one depth are ranked together.
+    #The one exception is a county first meeting the housing share, which can push in and later drop back out, so the values
+    #where that happens are checked directly as well.
+    def _bisected_breakpoints(self,start,stop):
+        points = set(sweep_grid(start,stop,max(1,(stop - start) // 64)).tolist())
+        for entry in self.housing_entries(start,stop):
+            points.update([entry - 1,entry])
+        values = np.array(sorted(points),dtype=np.int64)
+        known = dict(zip(values.tolist(),map(tuple,self.top(values).tolist())))
+        pending = [(a,b) for a, b in zip(values[:-1].tolist(),values[1:].tolist()) if known[a] != known[b] and b - a > 1]
+        while pending:
+            middles = [(a + b) // 2 for a, b in pending]
+            known.update(zip(middles,map(tuple,self.top(np.array(middles,dtype=np.int64)).tolist())))
+            pending = [(a,b) for (low, high), middle in zip(pending,middles) for a, b in [(low,middle),(middle,high)]
+                       if known[a] != known[b] and b - a > 1]
+        ordered = sorted(known.items())
+        changes = [ordered[0]] + [(value,top) for (_, before), (value,top) in zip(ordered[:-1],ordered[1:]) if top != before]
+        return np.array([value for value, top in changes],dtype=np.int64), np.array([top for value, top in changes],dtype=np.int64).reshape(-1,self.top_n)
+
+    #Function that returns the values where a county first meets the maximum housing share, if one is set.
+    #Only income cap sweeps with rescaled income can reorder counties around those values.
+    def housing_entries(self,start,stop):
+        share = self.limits[1]
+        if share is None or np.isnan(share) or self.variable != 'income_cap' or self.bring_income or share <= 0:
+            return []
+        #Smallest whole-dollar cap with housing <= share * cap, checked with the same comparison constraint_mask makes
+        entry = np.ceil(self.housing / share)
+        entry = np.where(self.housing <= share * (entry - 1),entry - 1,entry)
+        entry = np.where(self.housing <= share * entry,entry,entry + 1)
+        entry = entry[(entry <= np.rint(self.county_income * self.income_p)) & (entry > start) & (entry <= stop)]
+        return np.unique(entry).astype(np.int64).tolist()
+
+    #Function that turns top lists into a long frame with one row per value and rank, like batch.py's results
+    def frame(self,values,tops):
+        rows, ranks = np.nonzero(tops >= 0)
+        candidates = tops[rows,ranks]
+        counties = self.positions[candidates]
+        income = np.broadcast_to(self.income(values[rows],self.county_income[candidates]),len(rows))
+        total = self.total[candidates]
+        return pd.DataFrame({
+            'value': values[rows],
+            'rank': ranks + 1,
+            'county_state': self.cube.county_state[counties],
+            'state_abbr': self.cube.state_abbr[counties],
+            'FIPS': self.cube.fips[counties],
+            'county': self.cube.county[counties],
+            'total': total,
+            'median_monthly_family_income': income,
+            'remaining_money': income - total,
+        },columns=SWEEP_COLUMNS)
+
+    #Function that returns the top_n counties at every grid value, and at every breakpoint in the grid's range
+    def run(self,start,stop,step):
+        grid = sweep_grid(start,stop,step)
+        change_values, change_tops = self.breakpoints(start,stop)
+        return self.frame(grid,self.top(grid)), self.frame(change_values,change_tops)
@@ -0,0 +1,102 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+#Synthetic stand-in for the County sheet of the EPI workbook, for benchmarks and offline development.
+#Same columns, column order, family types and row order (every family for a county, county after county) as the real sheet,
+#with made-up but plausible values. The same seed and size always give the same data.
+
+STATES = ['AL','AK','AZ','AR','CA','CO','CT','DE','DC','FL','GA','HI','ID','IL','IN','IA','KS','KY','LA','ME','MD','MA','MI','MN','MS',
+          'MO','MT','NE','NV','NH','NJ','NM','NY','NC','ND','OH','OK','OR','PA','RI','SC','SD','TN','TX','UT','VT','VA','WA','WV','WI','WY']
+FAMILIES = [f'{adults}p{children}c' for adults in (1,2) for children in range(5)]
+NAME_PARTS = ['Adams','Baker','Clay','Douglas','Franklin','Grant','Jackson','Jefferson','Lake','Lincoln','Madison','Marion',
+              'Monroe','St. Louis','Saint Clair','St. Charles','Union','Warren','Washington','Wayne','Ste. Genevieve','Doña Ana']
+NAME_SUFFIXES = ['County','County','County','County','Parish','city','Borough']
+
+SHEET_COLUMNS = (['case_id','state_abbr','county_fips','county','family','housing','food','transportation','healthcare',
+                  'other_necessities','childcare','taxes','total'] +
+                 [f'annual_{column}' for column in ['housing','food','transportation','healthcare','other_necessities','childcare','taxes','total']] +
+                 ['median_family_income','num_counties_in_st','st_cost_rank','st_med_aff_rank','st_income_rank'])
+
+#Function that returns a raw County sheet for n_counties counties, as pd.read_excel(..., header=1) would
+def make_county_sheet(n_counties=3143, seed=0):
+    rng = np.random.default_rng(seed)
+    states = np.sort(rng.integers(0, len(STATES), n_counties))
+    names = []
+    seen = set()
+    for i, state in enumerate(states):
+        name = f'{NAME_PARTS[rng.integers(len(NAME_PARTS))]} {NAME_SUFFIXES[rng.integers(len(NAME_SUFFIXES))]}'
+        while (name, state) in seen:
+            name = f'{name.rsplit(" ", 1)[0]} {i} {name.rsplit(" ", 1)[1]}'
+        seen.add((name, state))
+        names.append(name)
+    fips = (states + 1) * 1000 + np.arange(n_counties) % 1000
+    annual_income = rng.normal(80000, 20000, n_counties).clip(30000, 200000).round()
+    annual_income[rng.integers(n_counties)] = np.nan #The real sheet is missing one county's median income
+
+    n_rows = n_counties * len(FAMILIES)
+    adults = np.tile(np.repeat([1, 2], 5), n_counties)
+    children = np.tile(np.tile(np.arange(5), 2), n_counties)
+    price_level = np.repeat(rng.lognormal(0, 0.2, n_counties), len(FAMILIES))
+    size = adults + 0.6 * children
+    costs = {
+        'housing': 900 + 150 * children,
+        'food': 300 * size,
+        'transportation': 700 + 250 * adults,
+        'healthcare': 400 * size,
+        'other_necessities': 250 * size,
+        'childcare': 700 * children,
+        'taxes': 350 * size,
+    }
+    sheet = {
+        'case_id': np.arange(1, n_rows + 1),
+        'state_abbr': np.repeat(np.array(STATES)[states], len(FAMILIES)),
+        'county_fips': np.repeat(fips, len(FAMILIES)),
+        'county': np.repeat(names, len(FAMILIES)),
+        'family': np.tile(FAMILIES, n_counties),
+    }
+    for column, base in costs.items():
+        sheet[column] = np.round(base * price_level * rng.uniform(0.85, 1.15, n_rows)).astype('int64')
+    sheet['total'] = sum(sheet[column] for column in costs)
+    for column in list(costs) + ['total']:
+        sheet[f'annual_{column}'] = sheet[column] * 12
+    sheet['median_family_income'] = np.repeat(annual_income, len(FAMILIES))
+    counties_in_state = np.bincount(states, minlength=len(STATES))[states]
+    sheet['num_counties_in_st'] = np.repeat(counties_in_state, len(FAMILIES))
+    for column in ['st_cost_rank','st_med_aff_rank','st_income_rank']:
+        sheet[column] = np.repeat(rng.integers(1, counties_in_state + 1), len(FAMILIES))
+    return pd.DataFrame(sheet, columns=SHEET_COLUMNS)
+
+#Function that returns household profiles in the format batch.py reads, using counties from a prepared table
+def make_profiles(df, n_profiles=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    counties = df.county_state.unique()
+    states = df.state_abbr.unique()
+    profiles = pd.DataFrame({
+        'county': counties[rng.integers(0, len(counties), n_profiles)],
+        'adults': rng.integers(1, 3, n_profiles),
+        'children': rng.integers(0, 5, n_profiles),
+        'income': rng.integers(3000, 15000, n_profiles),
+    })
+    for column, high in [('housing',3000),('food',1500),('transportation',1500),('healthcare',1500),('childcare',2500),('other_necessities',1000),('taxes',2000)]:
+        profiles[column] = rng.integers(0, high, n_profiles)
+    profiles['bring_income'] = rng.random(n_profiles) < 0.3
+    profiles['income_cap'] = np.where(rng.random(n_profiles) < 0.2, 8000, np.nan)
+    profiles['states'] = [' '.join(rng.choice(states, 3)) if use_states else '' for use_states in rng.random(n_profiles) < 0.3]
+    return profiles
+
+#Function that writes the sheet as a workbook laid out like EPI's (a title row above the header), for testing the ingest step
+def write_workbook(sheet, path):
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame([['Synthetic family budget data']]).to_excel(writer, sheet_name='County', header=False, index=False)
+        sheet.to_excel(writer, sheet_name='County', startrow=1, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic EPI-shaped workbook, e.g. for `python county_data.py --source`.')
+    parser.add_argument('output', help='Path of the .xlsx file to write')
+    parser.add_argument('--counties', type=int, default=3143, help='Number of counties (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: %(default)s)')
+    args = parser.parse_args()
+    write_workbook(make_county_sheet(args.counties, args.seed), args.output)
@@ -0,0 +1,84 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from batch import RESULT_COLUMNS, rank_profiles
+from county_data import build_lookups, compact_table, prepare_data, table_row
+from ranking import BUDGET_COLUMNS, CostCube, RankingEngine, budget_ratios
+from synthetic_data import make_county_sheet
+
+#rank_profiles() ranks many profiles at once with its own vectorized ratios and top-k selection. These tests check every
+#profile's results against RankingEngine.rank() with the same inputs, as the app would rank them.
+
+PROFILES = 300
+TOP_N = 7
+
+@pytest.fixture(scope='module')
+def data():
+    df, family_rows = build_lookups(compact_table(prepare_data(make_county_sheet(200,5))))
+    return df, RankingEngine(CostCube.from_table(df,family_rows),maxbytes=0)
+
+#Function that returns random profiles as read back from a CSV, so optional cells are blank the way users leave them
+def random_profiles(rng,engine):
+    cube = engine.cube
+    profiles = pd.DataFrame({
+        'county': cube.county_state[rng.integers(0,len(cube.county_state),PROFILES)],
+        'adults': rng.integers(1,3,PROFILES),
+        'children': rng.integers(0,5,PROFILES),
+        'income': rng.integers(2000,12000,PROFILES),
+    })
+    for column in BUDGET_COLUMNS:
+        profiles[column] = np.where(rng.random(PROFILES) < 0.05,0,rng.integers(0,2500,PROFILES))
+    profiles['bring_income'] = np.where(rng.random(PROFILES) < 0.5,rng.random(PROFILES) < 0.4,None)
+    profiles['income_cap'] = np.where(rng.random(PROFILES) < 0.3,rng.integers(3000,9000,PROFILES),np.nan)
+    separators = [' ',';',',']
+    profiles['states'] = [separators[i % 3].join(rng.choice(cube.states,int(rng.integers(1,5)))).lower() if rng.random() < 0.4 else ''
+                          for i in range(PROFILES)]
+    profiles['min_remaining'] = np.where(rng.random(PROFILES) < 0.3,rng.integers(-3000,2000,PROFILES),np.nan)
+    profiles['max_housing_share'] = np.where(rng.random(PROFILES) < 0.3,rng.uniform(0.1,0.4,PROFILES).round(3),np.nan)
+    profiles['max_total'] = np.where(rng.random(PROFILES) < 0.2,rng.integers(4000,9000,PROFILES),np.nan)
+    profiles['exclude_home'] = np.where(rng.random(PROFILES) < 0.3,True,None)
+    buffer = io.StringIO()
+    profiles.to_csv(buffer,index=False)
+    buffer.seek(0)
+    return pd.read_csv(buffer)
+
+#Function that reads a true/false cell; read_csv gives blank cells of a true/false column as NaN
+def flag(value):
+    return value is True
+
+#Function that ranks one profile the way the app would
+def engine_top(df,engine,profile):
+    family = f'{profile.adults}p{profile.children}c'
+    income_p, budget_p = budget_ratios(table_row(df,engine.cube.row(profile.county,family)),profile.income,[profile[column] for column in BUDGET_COLUMNS])
+    states = profile.states.upper().replace(';',' ').replace(',',' ').split() if isinstance(profile.states,str) else []
+    ranking = engine.rank(family,income_p,budget_p,flag(profile.bring_income),profile.income,not np.isnan(profile.income_cap),
+                          0 if np.isnan(profile.income_cap) else profile.income_cap,not states,states,
+                          min_remaining=None if np.isnan(profile.min_remaining) else profile.min_remaining,
+                          max_housing_share=None if np.isnan(profile.max_housing_share) else profile.max_housing_share,
+                          max_total=None if np.isnan(profile.max_total) else profile.max_total,
+                          exclude_county=profile.county if flag(profile.exclude_home) else None)
+    return ranking.top(TOP_N)
+
+@pytest.mark.filterwarnings('error::FutureWarning')
+def test_batch_matches_ranking_engine(data):
+    df, engine = data
+    rng = np.random.default_rng(7)
+    profiles = random_profiles(rng,engine)
+    results = rank_profiles(profiles,df,engine.cube,top_n=TOP_N,chunk_size=16)
+    assert list(results.columns) == RESULT_COLUMNS
+    by_profile = dict(tuple(results.groupby('profile')))
+    for i, profile in profiles.iterrows():
+        expected = engine_top(df,engine,profile)
+        found = by_profile.get(i,results.iloc[:0])
+        assert found['rank'].tolist() == list(range(1,len(expected) + 1)), i
+        for column in expected.columns:
+            assert found[column].tolist() == expected[column].tolist(), (i,column)
+
+def test_unknown_county_is_reported(data):
+    df, engine = data
+    profiles = pd.DataFrame([{'county': 'Nowhere County, ZZ','adults': 1,'children': 0,'income': 5000,**{column: 100 for column in BUDGET_COLUMNS}}])
+    with pytest.raises(ValueError,match='do not match a county'):
+        rank_profiles(profiles,df,engine.cube)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from county_data import build_lookups, compact_table, prepare_data, table_row
+from ranking import BUDGET_COLUMNS, CostCube, RankingEngine, budget_ratios
+from synthetic_data import make_county_sheet
+
+#RankingEngine ranks from the cost cube with top-k selection. These tests check it against the way the app ranked before:
+#rescale a copy of the family's rows of the prepared table with pandas, filter them, then sort them all by remaining money.
+
+CASES = 300
+RANKING_COLUMNS = (['state_abbr','FIPS','county','county_state'] + BUDGET_COLUMNS +
+                   ['total','median_monthly_family_income','median_monthly_family_income_uncapped','remaining_money'])
+
+@pytest.fixture(scope='module')
+def data():
+    full = prepare_data(make_county_sheet(200,4))
+    df, family_rows = build_lookups(compact_table(full))
+    return full, df, RankingEngine(CostCube.from_table(df,family_rows),maxbytes=0)
+
+#Function that returns random app inputs. Zero budgets, which rescale every cost to zero, tie every county on remaining money.
+def random_case(rng,df,engine):
+    county = df.county_state.iloc[rng.integers(len(df))]
+    family = str(rng.choice(engine.cube.families))
+    zero_budget = rng.random() < 0.1
+    budget = [0] * len(BUDGET_COLUMNS) if zero_budget else [int(value) for value in rng.integers(0,2500,len(BUDGET_COLUMNS))]
+    income_p, budget_p = budget_ratios(table_row(df,engine.cube.row(county,family)),int(rng.integers(2000,12000)),budget)
+    all_states = rng.random() < 0.5
+    return {
+        'family': family,
+        'income_p': income_p,
+        'budget_p': budget_p,
+        'bring_income': zero_budget or rng.random() < 0.3,
+        'user_income': int(rng.integers(2000,12000)),
+        'income_cap': rng.random() < 0.3,
+        'income_cap_amount': int(rng.integers(3000,9000)),
+        'include_all_states': all_states,
+        'states': [] if all_states else [str(state) for state in rng.choice(engine.cube.states,int(rng.integers(1,6)))],
+        'min_remaining': None if rng.random() < 0.6 else int(rng.integers(-3000,2000)),
+        'max_housing_share': None if rng.random() < 0.6 else float(rng.uniform(0.1,0.4)),
+        'max_total': None if rng.random() < 0.7 else int(rng.integers(4000,9000)),
+        'exclude_county': county if rng.random() < 0.3 else None,
+    }
+
+#Function that ranks every county of the family with pandas, as the app did before the cost cube
+def reference_ranking(full,case):
+    new_df = full.loc[full.family == case['family']].reset_index(drop=True)
+    if case['bring_income']:
+        new_df['median_monthly_family_income'] = case['user_income']
+    else:
+        new_df['median_monthly_family_income'] = new_df.median_monthly_family_income.mul(case['income_p']).round(0).astype('int64')
+    new_df['median_monthly_family_income_uncapped'] = new_df.median_monthly_family_income
+    if case['income_cap']:
+        new_df['median_monthly_family_income'] = new_df.median_monthly_family_income.clip(upper=case['income_cap_amount'])
+    if not case['include_all_states']:
+        new_df = new_df.loc[new_df.state_abbr.isin(case['states'])]
+    if case['exclude_county'] is not None:
+        new_df = new_df.loc[new_df.county_state != case['exclude_county']]
+    for column, p in zip(BUDGET_COLUMNS,case['budget_p']):
+        new_df[column] = new_df[column].mul(p).round(0).astype('int64')
+    new_df['total'] = new_df[BUDGET_COLUMNS].sum(axis=1)
+    new_df['remaining_money'] = new_df.median_monthly_family_income - new_df.total
+    if case['min_remaining'] is not None:
+        new_df = new_df.loc[new_df.remaining_money >= case['min_remaining']]
+    if case['max_housing_share'] is not None:
+        income = new_df.median_monthly_family_income
+        new_df = new_df.loc[(income > 0) & (new_df.housing <= case['max_housing_share'] * income)]
+    if case['max_total'] is not None:
+        new_df = new_df.loc[new_df.total <= case['max_total']]
+    return new_df.sort_values('remaining_money',ascending=False,kind='stable').reset_index(drop=True)
+
+def test_ranking_matches_pandas_sort(data):
+    full, df, engine = data
+    rng = np.random.default_rng(5)
+    for _ in range(CASES):
+        case = random_case(rng,df,engine)
+        ranking = engine.rank(case['family'],case['income_p'],case['budget_p'],case['bring_income'],case['user_income'],case['income_cap'],
+                              case['income_cap_amount'],case['include_all_states'],case['states'],min_remaining=case['min_remaining'],
+                              max_housing_share=case['max_housing_share'],max_total=case['max_total'],exclude_county=case['exclude_county'])
+        expected = reference_ranking(full,case)
+        assert ranking.count == len(expected), case
+        k = int(rng.integers(1,len(expected) + 5)) if len(expected) else 5
+        top = ranking.top(k)
+        for column in RANKING_COLUMNS:
+            assert top[column].tolist() == expected[column][:k].tolist(), (column,case)
+
+def test_pages_join_up_to_the_full_ranking(data):
+    full, df, engine = data
+    rng = np.random.default_rng(6)
+    case = random_case(rng,df,engine)
+    ranking = engine.rank(case['family'],case['income_p'],case['budget_p'],False,case['user_income'],False,0,True,[])
+    pages = [ranking.page(start,start + 30).county_state.tolist() for start in range(0,ranking.count,30)]
+    assert sum(pages,[]) == ranking.top(ranking.count).county_state.tolist()
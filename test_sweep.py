@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from county_data import TABLE_COLUMNS, build_lookups, compact_table, prepare_data, table_row
+from ranking import BUDGET_COLUMNS, CostCube, RankingEngine, budget_ratios
+from sweep import Sweep
+from synthetic_data import make_county_sheet
+
+#Sweep.breakpoints() skips most values (bisection, contender pruning, housing share entry points), so these tests rank
+#every single dollar of a range with RankingEngine, the way the app would, and check the sweep finds exactly the same changes.
+
+CASES_PER_MODE = 5
+
+@pytest.fixture(scope='module')
+def data():
+    df, family_rows = build_lookups(compact_table(prepare_data(make_county_sheet(200,3))))
+    return df, RankingEngine(CostCube.from_table(df,family_rows),maxbytes=0)
+
+#Function that returns random settings for one sweep: everything Sweep and RankingEngine.rank take, besides the swept value
+def random_case(rng,df,engine,variable,bring_income):
+    county = df.county_state.iloc[rng.integers(len(df))]
+    family = str(rng.choice(['1p0c','2p2c','1p3c']))
+    row = table_row(df,engine.cube.row(county,family))
+    budget = [int(value) for value in rng.integers(300,2500,len(BUDGET_COLUMNS))]
+    user_income = int(rng.integers(3000,12000))
+    all_states = rng.random() < 0.6
+    return {
+        'county': county,
+        'family': family,
+        'row': row,
+        'budget': budget,
+        'user_income': user_income,
+        'bring_income': bring_income,
+        'income_cap': variable == 'income_cap' or rng.random() < 0.3,
+        'income_cap_amount': int(rng.integers(4000,10000)),
+        'include_all_states': all_states,
+        'states': [] if all_states else [str(state) for state in rng.choice(engine.cube.states,5)],
+        'min_remaining': None if rng.random() < 0.5 else int(rng.integers(-2000,1000)),
+        'max_housing_share': None if rng.random() < 0.3 else float(rng.uniform(0.2,0.35)),
+        'max_total': None if rng.random() < 0.7 else int(rng.integers(5000,9000)),
+        'exclude_county': county if rng.random() < 0.3 else None,
+        'top_n': int(rng.integers(1,8)),
+    }
+
+#Function that returns the county names the app would list at one value of the swept setting
+def ranked_at(engine,case,variable,value):
+    if variable == 'income_cap':
+        income_p, budget_p = budget_ratios(case['row'],case['user_income'],case['budget'])
+        user_income, income_cap, income_cap_amount = case['user_income'], True, value
+    else:
+        income_p, budget_p = budget_ratios(case['row'],value,case['budget'])
+        user_income, income_cap, income_cap_amount = value, case['income_cap'], case['income_cap_amount']
+    ranking = engine.rank(case['family'],income_p,budget_p,case['bring_income'],user_income,income_cap,income_cap_amount,
+                          case['include_all_states'],case['states'],min_remaining=case['min_remaining'],
+                          max_housing_share=case['max_housing_share'],max_total=case['max_total'],exclude_county=case['exclude_county'])
+    return tuple(ranking.top(case['top_n']).county_state)
+
+@pytest.mark.parametrize('variable,bring_income',[('income_cap',False),('income_cap',True),('income',False),('income',True)])
+def test_breakpoints_match_ranking_every_value(data,variable,bring_income):
+    df, engine = data
+    rng = np.random.default_rng(1)
+    for _ in range(CASES_PER_MODE):
+        case = random_case(rng,df,engine,variable,bring_income)
+        income_p, budget_p = budget_ratios(case['row'],case['user_income'],case['budget'])
+        sweep = Sweep(engine.cube,case['family'],income_p,budget_p,bring_income,case['user_income'],case['income_cap'],case['income_cap_amount'],
+                      case['include_all_states'],case['states'],case['min_remaining'],case['max_housing_share'],case['max_total'],
+                      case['exclude_county'],case['row'].median_monthly_family_income,variable,case['top_n'])
+        start = int(rng.integers(2000,6000))
+        stop = start + int(rng.integers(300,1000))
+        values, tops = sweep.breakpoints(start,stop)
+        found = [(int(value),tuple(engine.cube.county_state[sweep.positions[top[top >= 0]]])) for value, top in zip(values,tops)]
+
+        expected = []
+        for value in range(start,stop + 1):
+            counties = ranked_at(engine,case,variable,value)
+            if not expected or counties != expected[-1][1]:
+                expected.append((value,counties))
+        assert found == expected, case
+
+@pytest.mark.parametrize('variable',['income_cap','income'])
+def test_grid_frame_matches_ranking(data,variable):
+    df, engine = data
+    rng = np.random.default_rng(2)
+    case = random_case(rng,df,engine,variable,False)
+    income_p, budget_p = budget_ratios(case['row'],case['user_income'],case['budget'])
+    sweep = Sweep(engine.cube,case['family'],income_p,budget_p,False,case['user_income'],case['income_cap'],case['income_cap_amount'],
+                  case['include_all_states'],case['states'],case['min_remaining'],case['max_housing_share'],case['max_total'],
+                  case['exclude_county'],case['row'].median_monthly_family_income,variable,case['top_n'])
+    grid, changes = sweep.run(3000,6000,500)
+    for value in [3000,4500,6000]:
+        assert tuple(grid[grid.value == value].county_state) == ranked_at(engine,case,variable,value)
+
+#County A only meets a 30% housing share once the cap reaches $4,000, and leads until county B passes it at $4,051.
+#Both ends of the grid range around it (from $3,977 to $4,101) rank B first, so only checking where counties
+#first meet the housing share finds A.
+def test_housing_share_entry_between_grid_points():
+    counties = pd.DataFrame({'county': ['A','B'],'housing': [1200,100],'food': [100,1250],'median_monthly_family_income': [4000,9000]})
+    for column in ['transportation','healthcare','other_necessities','childcare','taxes']:
+        counties[column] = 0
+    counties['state_abbr'] = 'ST'
+    counties['FIPS'] = ['00001','00002']
+    counties['family'] = '1p0c'
+    counties['county_state'] = counties.county + ', ST'
+    counties['total'] = counties.housing + counties.food
+    counties['remaining_money'] = counties.median_monthly_family_income - counties.total
+    df, family_rows = build_lookups(compact_table(counties[TABLE_COLUMNS]))
+    engine = RankingEngine(CostCube.from_table(df,family_rows),maxbytes=0)
+    row = table_row(df,engine.cube.row('B, ST','1p0c'))
+    case = {'family': '1p0c','row': row,'budget': [int(row[column]) for column in BUDGET_COLUMNS],'user_income': 9000,'bring_income': False,
+            'include_all_states': True,'states': [],'min_remaining': None,'max_housing_share': 0.3,'max_total': None,'exclude_county': None,'top_n': 1}
+    income_p, budget_p = budget_ratios(row,case['user_income'],case['budget'])
+    sweep = Sweep(engine.cube,'1p0c',income_p,budget_p,False,9000,True,9000,True,[],max_housing_share=0.3,top_n=1)
+    values, tops = sweep.breakpoints(1001,9000)
+    found = [(int(value),tuple(engine.cube.county_state[top[top >= 0]])) for value, top in zip(values,tops)]
+    assert found == [(1001,('B, ST',)),(4000,('A, ST',)),(4051,('B, ST',))]
+    assert all(ranked_at(engine,case,'income_cap',value) == counties for value, counties in found)
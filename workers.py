@@ -0,0 +1,47 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+
+#Ranking and formatting run on a small thread pool shared by every session in the process, so the server's event loop
+#(which serves every session) keeps answering other users while they run. Threads rather than processes, since the work reads
+#the shared ranking engine and its cache, and NumPy releases the GIL for the large array operations.
+#WORKER_THREADS sets the pool size.
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', min(4, os.cpu_count() or 1)))
+
+_executor = None
+_chart_executor = None
+_executor_lock = threading.Lock()
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix='results')
+    return _executor
+
+#Image charts are drawn on a thread of their own. Matplotlib is not thread-safe, so they are drawn one at a time anyway, and
+#most of its drawing is Python code holding the GIL; queueing them here keeps a slow chart from holding a pool thread
+#while it waits its turn, so other sessions' results are not stuck behind a row of charts.
+def chart_executor():
+    global _chart_executor
+    with _executor_lock:
+        if _chart_executor is None:
+            _chart_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='charts')
+    return _chart_executor
+
+
+#Runs one kind of job for one session on the pool, at most one at a time.
+#A new request waits for the session's running job instead of piling more onto the pool. Panel cancels a superseded request
+#while it waits, so after a burst of clicks only the running job and the latest request are computed; the ones in between never start.
+class LatestOnly:
+    def __init__(self):
+        self.running = None
+
+    #Function that runs function(*args) on pool, by default the shared worker pool
+    async def run(self, function, *args, pool=None):
+        if self.running is not None and not self.running.done():
+            #A running thread cannot be stopped, so wait for it without cancelling it if this request is itself superseded
+            await asyncio.wait([asyncio.wrap_future(self.running)])
+        self.running = (pool or executor()).submit(function, *args)
+        return await asyncio.wrap_future(self.running)